@@ -0,0 +1,330 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timedelta
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(THIS_DIR)
+
+# What prestartup_script.py runs before the menu shows up, with its logs and cache in the benchmark directory
+STARTUP_SNIPPET = (
+    "import os, utils;"
+    "utils.LOG_DIR, utils.REQUIREMENTS_CACHE = {log_dir!r}, {requirements_cache!r};"
+    "utils.initialize(utils.CONFIG_PATH);"
+    "utils.requirements_installer(os.path.join(utils.THIS_DIR, 'requirements.txt'))"
+)
+# Kinds of custom node generated in the fake installation
+KINDS = ('utd', 'outdated', 'dirty', 'detached', 'broken')
+DEFAULT_MIX = 'utd=0.6,outdated=0.2,dirty=0.1,detached=0.05,broken=0.05'
+GIT_IDENTITY = ['-c', 'user.name=bench', '-c', 'user.email=bench@localhost']
+BENCHMARKS = ('update', 'git', 'starstracker', 'startup')
+
+
+def run(args, cwd=None, env=None):
+    return subprocess.run(args, cwd=cwd, env=env, check=True, capture_output=True, text=True).stdout
+
+
+def commit_all(work, message, date=None):
+    env = dict(os.environ, GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date) if date else None
+    run(['git', 'add', '-A'], cwd=work)
+    run(['git', *GIT_IDENTITY, 'commit', '-q', '-m', message], cwd=work, env=env)
+
+
+def make_repo(remotes_dir, clones_dir, name):
+    # Create a bare remote with one commit and clone it into the fake custom_nodes
+    remote = os.path.join(remotes_dir, f'{name}.git')
+    work = os.path.join(remotes_dir, f'{name}-work')
+    run(['git', 'init', '-q', '-b', 'main', work])
+    with open(os.path.join(work, 'README.md'), 'w', encoding='utf-8') as file:
+        file.write(f'# {name}\n')
+    commit_all(work, 'initial')
+    run(['git', 'clone', '-q', '--bare', work, remote])
+    shutil.rmtree(work)
+    run(['git', 'clone', '-q', remote, os.path.join(clones_dir, name)])
+    return remote
+
+
+def push_commits(remote, count):
+    # Add commits to a remote behind the back of its clone, touching both the README and the code
+    work = remote[:-len('.git')] + '-push'
+    run(['git', 'clone', '-q', remote, work])
+    for i in range(count):
+        with open(os.path.join(work, 'README.md'), 'a', encoding='utf-8') as file:
+            file.write(f'\n## Release {i}\nSomething new in release {i}.\n')
+        with open(os.path.join(work, 'nodes.py'), 'a', encoding='utf-8') as file:
+            file.write(f'VERSION_{i} = {i}\n')
+        commit_all(work, f'Release {i}')
+    run(['git', 'push', '-q'], cwd=work)
+    shutil.rmtree(work)
+
+
+def make_node(remotes_dir, custom_nodes, name, kind):
+    remote = make_repo(remotes_dir, custom_nodes, name)
+    clone = os.path.join(custom_nodes, name)
+    if kind in ('outdated', 'dirty', 'detached'):
+        push_commits(remote, 3)
+    if kind == 'dirty':
+        # Local edits that the update has to stash and restore
+        with open(os.path.join(clone, 'README.md'), 'a', encoding='utf-8') as file:
+            file.write('Local notes.\n')
+        with open(os.path.join(clone, 'local_settings.py'), 'w', encoding='utf-8') as file:
+            file.write('DEBUG = True\n')
+    elif kind == 'detached':
+        run(['git', 'checkout', '-q', '--detach'], cwd=clone)
+    elif kind == 'broken':
+        run(['git', 'remote', 'remove', 'origin'], cwd=clone)
+
+
+def make_manager(path, repos, days, seed):
+    # ComfyUI-Manager lookalike: custom-node-list.json and one github-stats.json commit per day
+    rng = random.Random(seed)
+    run(['git', 'init', '-q', '-b', 'main', path])
+    urls = [f'https://github.com/author{i}/ComfyUI-Node_{i}' for i in range(repos)]
+    nodes = [
+        {'reference': url, 'title': f'Node {i}', 'description': f"Nodes number {i}. [w/Needs a [a/model](https://example.com/{i})]"}
+        for i, url in enumerate(urls)
+    ]
+    with open(os.path.join(path, 'custom-node-list.json'), 'w', encoding='utf-8') as file:
+        json.dump({'custom_nodes': nodes}, file, indent=4)
+    stars = {url: rng.randint(0, 2000) for url in urls}
+    growth = {url: rng.random() ** 3 * 20 for url in urls}
+    updated = {url: datetime.now() - timedelta(days=rng.randint(0, 365)) for url in urls}
+    now = datetime.now()
+    for day in range(days, -1, -1):
+        for url in urls:
+            stars[url] += int(growth[url] * rng.random())
+        stats = {
+            url: {'stars': count, 'last_update': updated[url].strftime('%Y-%m-%d %H:%M:%S')}
+            for url, count in stars.items()
+        }
+        with open(os.path.join(path, 'github-stats.json'), 'w', encoding='utf-8') as file:
+            json.dump(stats, file, indent=4)
+        commit_all(path, 'update github-stats.json', (now - timedelta(days=day)).strftime('%Y-%m-%dT%H:%M:%S'))
+
+
+def parse_mix(mix):
+    shares = {kind: float(share) for kind, share in (item.split('=') for item in mix.split(','))}
+    unknown = set(shares) - set(KINDS)
+    if unknown:
+        raise SystemExit(f"Unknown kinds in --mix: {', '.join(sorted(unknown))}, expected {', '.join(KINDS)}")
+    return shares
+
+
+def make_fixture(root, count, mix, manager_repos, days, seed):
+    # Lay out remotes/ and ComfyUI/custom_nodes/ like a real installation, returns the kind of each node
+    remotes_dir = os.path.join(root, 'remotes')
+    comfyui = os.path.join(root, 'ComfyUI')
+    custom_nodes = os.path.join(comfyui, 'custom_nodes')
+    os.makedirs(remotes_dir)
+    make_repo(remotes_dir, root, 'ComfyUI')
+    os.makedirs(custom_nodes)
+    shares = parse_mix(mix)
+    total = sum(shares.values())
+    kinds = [kind for kind in KINDS for _ in range(round(count * shares.get(kind, 0) / total))]
+    kinds = (kinds + ['utd'] * count)[:count]
+    # Same layout for a given seed, so results of different commits compare
+    random.Random(seed).shuffle(kinds)
+    nodes = {}
+    for i, kind in enumerate(kinds):
+        name = f'node-{i:03d}'
+        make_node(remotes_dir, custom_nodes, name, kind)
+        nodes[name] = kind
+    make_manager(os.path.join(custom_nodes, 'ComfyUI-Manager'), manager_repos, days, seed)
+    nodes['ComfyUI-Manager'] = 'utd'
+    return nodes
+
+
+def isolate(root):
+    # Logs and the requirements cache go to root, before the first initialize() prunes the logs of the installation
+    import utils
+    utils.LOG_DIR = os.path.join(root, 'logs')
+    utils.REQUIREMENTS_CACHE = os.path.join(root, 'requirements_cache.json')
+    os.makedirs(utils.LOG_DIR, exist_ok=True)
+    return {'log_dir': utils.LOG_DIR, 'requirements_cache': utils.REQUIREMENTS_CACHE}
+
+
+def point_at(tree):
+    # Aim updater and starstracker at a fixture copy, with their caches inside it
+    import updater
+    import starstracker
+    import repo_state
+    import discovery
+    import dependencies
+    comfyui = os.path.join(tree, 'ComfyUI')
+    custom_nodes = os.path.join(comfyui, 'custom_nodes')
+    manager = os.path.join(custom_nodes, 'ComfyUI-Manager')
+    cache = os.path.join(tree, 'cache')
+    os.makedirs(cache, exist_ok=True)
+    updater.COMFYUI, updater.CUSTOM_NODES_DIR = comfyui, custom_nodes
+    starstracker.CUSTOM_NODES_DIR, starstracker.MANAGER_DIR = custom_nodes, manager
+    starstracker.GITHUB_STATS_PATH = os.path.join(manager, 'github-stats.json')
+    starstracker.CUSTOM_NODE_LIST_PATH = os.path.join(manager, 'custom-node-list.json')
+    starstracker.STARSTRACKER = os.path.join(cache, 'Starstracker.json')
+    starstracker.NODE_INDEX = os.path.join(cache, 'custom_nodes_index.sqlite')
+    starstracker.STARS_CACHE_DIR = os.path.join(cache, 'stars_cache')
+    starstracker.STARS_SERIES_DIR = os.path.join(cache, 'stars_series')
+    starstracker.SERIES_INDEX = os.path.join(starstracker.STARS_SERIES_DIR, 'index.json')
+    starstracker.SERIES_DATA = os.path.join(starstracker.STARS_SERIES_DIR, 'stars.bin')
+    repo_state.COMFYUI, repo_state.CUSTOM_NODES_DIR = comfyui, custom_nodes
+    repo_state.REPO_STATE = os.path.join(cache, 'repo_state.json')
+    discovery.DISCOVERY_CACHE = os.path.join(cache, 'discovery_cache.json')
+    dependencies.DEPENDENCIES_CACHE = os.path.join(cache, 'dependencies_cache.json')
+    return custom_nodes
+
+
+class Fixture:
+    # A pristine installation, copied afresh for every measured run so each one starts from the same state
+    def __init__(self, root, pristine):
+        self.root = root
+        self.pristine = pristine
+        self.copies = 0
+
+    def fresh(self):
+        if self.copies:
+            shutil.rmtree(os.path.join(self.root, f'run-{self.copies}'), ignore_errors=True)
+        self.copies += 1
+        tree = os.path.join(self.root, f'run-{self.copies}')
+        shutil.copytree(self.pristine, tree, symlinks=True)
+        return tree
+
+
+def bench_update(fixture, jobs_list, runs):
+    import updater
+    results = {}
+    for jobs in jobs_list:
+        updater.config['jobs'] = jobs
+        timings = []
+        for _ in range(runs):
+            point_at(fixture.fresh())
+            start = time.perf_counter()
+            asyncio.run(updater.update())
+            timings.append(time.perf_counter() - start)
+        results[f'update[jobs={jobs}]'] = statistics.median(timings)
+    return results
+
+
+def bench_git(fixture, nodes, runs):
+    # Mean git() time per kind of repository, one repository at a time
+    import updater
+    timings = {kind: [] for kind in KINDS}
+    for _ in range(runs):
+        custom_nodes = point_at(fixture.fresh())
+        for name, kind in nodes.items():
+            start = time.perf_counter()
+            asyncio.run(updater.git(os.path.join(custom_nodes, name)))
+            timings[kind].append(time.perf_counter() - start)
+    return {f'git[{kind}]': statistics.mean(values) for kind, values in timings.items() if values}
+
+
+def bench_starstracker(fixture, runs):
+    # Cold runs build every cache from the Manager history, warm runs reuse them
+    import starstracker
+    cold, warm = [], []
+    for _ in range(runs):
+        point_at(fixture.fresh())
+        for timings in (cold, warm):
+            start = time.perf_counter()
+            asyncio.run(starstracker.starstracker())
+            timings.append(time.perf_counter() - start)
+    return {'starstracker[cold]': statistics.median(cold), 'starstracker[warm]': statistics.median(warm)}
+
+
+def bench_startup(runs, paths):
+    # Time fresh interpreters going through the pre-menu startup path
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        run([sys.executable, '-c', STARTUP_SNIPPET.format(**paths)], cwd=THIS_DIR)
+        timings.append(time.perf_counter() - start)
+    return {'startup': statistics.median(timings)}
+
+
+def current_commit():
+    try:
+        return run(['git', 'rev-parse', 'HEAD'], cwd=THIS_DIR).strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def compare(report, baseline_path):
+    with open(baseline_path, 'r', encoding='utf-8') as file:
+        baseline = json.load(file)
+    print(f"\nCompared with {(baseline.get('commit') or 'unknown')[:10]} ({baseline_path}), above 1 is faster")
+    for name, seconds in report['results'].items():
+        before = baseline['results'].get(name)
+        if before:
+            print(f"  {name:<22} {before * 1000:9.1f} ms -> {seconds * 1000:9.1f} ms  x{before / seconds:.2f}")
+        else:
+            print(f"  {name:<22} {'new':>12} -> {seconds * 1000:9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time update(), git(), starstracker() and startup offline, on a synthetic installation")
+    parser.add_argument('--repos', type=int, default=50, help="number of custom nodes to generate")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"share of each kind of node, default {DEFAULT_MIX}")
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 4, 8], help="job counts to time update() with")
+    parser.add_argument('--runs', type=int, default=3, help="measured runs per benchmark, the median is kept")
+    parser.add_argument('--manager-repos', type=int, default=2000, help="nodes listed in the fake ComfyUI-Manager")
+    parser.add_argument('--days', type=int, default=60, help="days of github-stats.json history")
+    parser.add_argument('--startup', type=int, default=10, help="interpreter startups to time")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the fixture layout and star counts")
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=BENCHMARKS, help="benchmarks to run")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--compare', help="results JSON of an earlier commit to compare with")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='up2date-bench-')
+    paths = isolate(root)
+    import updater
+    # Keep benchmark runs off the console and out of the real run reports, lockfiles and mirrors
+    updater.console.quiet = True
+    updater.config['report'] = False
+    updater.config['prometheus_textfile'] = ""
+    updater.config['lockfile'] = False
+    updater.config['mirror_dir'] = ""
+
+    results = {}
+    try:
+        if {'update', 'git', 'starstracker'} & set(args.only):
+            pristine = os.path.join(root, 'pristine')
+            nodes = make_fixture(pristine, args.repos, args.mix, args.manager_repos, args.days, args.seed)
+            fixture = Fixture(root, pristine)
+        if 'update' in args.only:
+            results.update(bench_update(fixture, args.jobs, args.runs))
+        if 'git' in args.only:
+            results.update(bench_git(fixture, nodes, args.runs))
+        if 'starstracker' in args.only:
+            results.update(bench_starstracker(fixture, args.runs))
+        if 'startup' in args.only and args.startup:
+            results.update(bench_startup(args.startup, paths))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        'commit': current_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'results': results,
+    }
+    for name, seconds in results.items():
+        print(f"{name:<24} {seconds * 1000:9.1f} ms")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=4)
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
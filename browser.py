@@ -0,0 +1,85 @@
+import json
+import asyncio
+
+from starstracker import render_node
+
+
+class TrendingBrowser:
+    # Ranked Starstracker.json entries kept in memory, rendered a few pages ahead of the cursor
+    def __init__(self, path, config, console):
+        with open(path, 'r', encoding='utf-8') as file:
+            self.nodes = json.load(file)
+        self.config = config
+        self.console = console
+        self.page_size = max(1, int(config.get('browser_page_size', 10)))
+        self.index = 0
+        self.marked = set() # Indices of the nodes picked for installation
+        self._rendered = {}
+        self._search_text = None
+        self._prefetch = None
+
+    @property
+    def current(self):
+        return self.nodes[self.index]
+
+    def rendered(self, index):
+        if index not in self._rendered:
+            self._rendered[index] = render_node(self.nodes[index], self.config)
+        return self._rendered[index]
+
+    async def _render_ahead(self, start):
+        # Prepare the next pages while the user reads the current node
+        for index in range(start, min(start + 2 * self.page_size, len(self.nodes))):
+            self.rendered(index)
+            await asyncio.sleep(0) # Keep the menu responsive between nodes
+
+    def show(self):
+        mark = f"  ✓ marked ({len(self.marked)} in total)" if self.index in self.marked else ""
+        self.console.print(f"\n{self.index + 1}/{len(self.nodes)}{mark}", style='secondary')
+        for text in self.rendered(self.index):
+            self.console.print(text)
+        if self._prefetch:
+            self._prefetch.cancel()
+        self._prefetch = asyncio.create_task(self._render_ahead(self.index + 1))
+
+    def toggle_mark(self):
+        self.marked ^= {self.index}
+
+    def install_urls(self):
+        # The marked nodes in ranking order, or the current one when nothing is marked
+        indices = sorted(self.marked) or [self.index]
+        return [self.nodes[index].get('url', 'Unknown') for index in indices]
+
+    def move(self, offset):
+        # Returns False when the move would leave the list
+        index = self.index + offset
+        if not 0 <= index < len(self.nodes):
+            return False
+        self.index = index
+        return True
+
+    def page(self, pages):
+        self.index = min(max(self.index + pages * self.page_size, 0), len(self.nodes) - 1)
+
+    def jump(self, position):
+        # Positions are 1-based, as shown above each node
+        self.index = min(max(position - 1, 0), len(self.nodes) - 1)
+
+    def search(self, text):
+        # Move to the next node whose title, URL or description contains text, wrapping around
+        if self._search_text is None:
+            self._search_text = [
+                f"{node.get('title', '')} {node.get('url', '')} {node.get('description', '')}".lower()
+                for node in self.nodes
+            ]
+        text = text.lower()
+        for offset in range(1, len(self.nodes) + 1):
+            index = (self.index + offset) % len(self.nodes)
+            if text in self._search_text[index]:
+                self.index = index
+                return True
+        return False
+
+    def close(self):
+        if self._prefetch:
+            self._prefetch.cancel()
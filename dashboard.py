@@ -0,0 +1,64 @@
+import time
+
+from rich.console import Group
+from rich.live import Live
+from rich.progress_bar import ProgressBar
+from rich.table import Table
+from rich.text import Text
+
+
+class UpdateDashboard:
+    # Live view of an update run: progress, counters and the repositories being updated
+    # Redrawn by Rich at a fixed rate from its own thread, so drawing never waits on git and git never waits on drawing
+    def __init__(self, console, config, total):
+        self.console = console
+        self.config = config
+        self.total = total
+        self.running = {} # Name of each repository being updated, with its start time
+        self.counts = {'UTD': 0, 'outdated': 0, 'error': 0}
+        self.start = time.perf_counter()
+        self.live = Live(
+            self,
+            console=console,
+            refresh_per_second=max(1, float(config.get('refresh_rate', 4))),
+            transient=True, # The scrollback keeps the summary, not the last frame
+        )
+
+    def __enter__(self):
+        self.live.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.live.stop()
+        # The counters stay in the scrollback under the repositories printed during the run
+        self.console.print(self.counters())
+
+    def started(self, name):
+        self.running[name] = time.perf_counter()
+
+    def finished(self, name, status):
+        self.running.pop(name, None)
+        self.counts[status['flag']] = self.counts.get(status['flag'], 0) + 1
+
+    def counters(self):
+        return Text.assemble(
+            (f"🗸 {self.counts['UTD']} up to date  ", 'up_to_date'),
+            (f"🡅 {self.counts['outdated']} updated  ", 'updating'),
+            (f"🞫 {self.counts['error']} failed", 'error'),
+            (f"  {len(self.running)} in progress" if self.running else "", 'secondary'),
+        )
+
+    def __rich__(self):
+        done = sum(self.counts.values())
+        header = Table.grid(padding=(0, 1))
+        header.add_row(
+            Text("Updating repositories", style='secondary'),
+            ProgressBar(total=self.total, completed=done, width=30, style='secondary', complete_style='primary'),
+            Text(f"{done}/{self.total} - {time.perf_counter() - self.start:.0f}s", style='secondary'),
+        )
+        table = Table(box=None, show_header=False, padding=(0, 1), pad_edge=False)
+        now = time.perf_counter()
+        # Copied first, jobs start and finish while Rich draws from its thread
+        for name, since in list(self.running.items()):
+            table.add_row(Text("⋯", style='updating'), Text(name, style='primary'), Text(f"{now - since:.1f}s", style='secondary'))
+        return Group(header, self.counters(), table)
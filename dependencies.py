@@ -0,0 +1,123 @@
+import os
+import sys
+import json
+import asyncio
+import hashlib
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.join(THIS_DIR, 'config.json')
+# Requirement sets found satisfied, keyed by a hash of their lines, with the environment they were checked in
+DEPENDENCIES_CACHE = os.path.join(THIS_DIR, 'dependencies_cache.json')
+DEPENDENCIES_CACHE_SIZE = 50
+# Files of a custom node that change what it needs installed
+DEPENDENCY_FILES = ('requirements.txt', 'install.py')
+
+from utils import initialize, environment_fingerprint, missing_requirements, strip_comment
+
+config, theme, console, log_ = initialize(CONFIG_PATH)
+
+
+def changed_nodes(results):
+    # Updated nodes whose requirements.txt or install.py changed, results are (name, directory, status) tuples
+    return [(name, dir_path, status) for name, dir_path, status in results if status.get('dependencies')]
+
+
+def read_requirements(paths):
+    # Requirement lines of every file, duplicates removed, in a stable order
+    lines = set()
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file.read().splitlines():
+                line = strip_comment(line)
+                if line:
+                    lines.add(line)
+    return sorted(lines)
+
+
+def load_cache():
+    try:
+        with open(DEPENDENCIES_CACHE, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_cache(cache, key, fingerprint):
+    cache.pop(key, None)
+    cache[key] = fingerprint
+    # Oldest entries first, drop them beyond the cache size
+    cache = dict(list(cache.items())[-DEPENDENCIES_CACHE_SIZE:])
+    try:
+        with open(DEPENDENCIES_CACHE, 'w', encoding='utf-8') as file:
+            json.dump(cache, file, indent=4)
+    except OSError as e:
+        log_('w', f"Error saving dependencies cache: {e}")
+
+
+async def run_python(args, cwd=None):
+    # Run the interpreter of ComfyUI with args, returns its exit status and combined output
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, *args, cwd=cwd,
+        stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+    )
+    output, _ = await process.communicate()
+    return process.returncode, output.decode('utf-8', errors='replace')
+
+
+async def pip_install(requirements_paths, owner="custom nodes"):
+    # One pip resolution for several requirements files, pip_args can point pip at a local wheel directory
+    # Files are passed as they are so that their index options, nested files and hashes still apply
+    pip_args = config.get('pip_args') or []
+    log_('i', f"Installing the requirements of {owner}")
+    status, output = await run_python(['-m', 'pip', 'install', *pip_args, *(arg for path in requirements_paths for arg in ('-r', path))])
+    log_('d', output)
+    if status != 0:
+        # pip puts the reason on its last line
+        reason = output.strip().splitlines()[-1] if output.strip() else f"pip returned {status}"
+        log_('e', f"Failed to install the requirements of {owner}: {reason}")
+        return False
+    return True
+
+
+async def install_dependencies(results):
+    # Install what the custom nodes updated in this run now require
+    if not config.get('install_dependencies', True):
+        return
+    nodes = changed_nodes(results)
+    if not nodes:
+        return
+    requirements_paths = {
+        name: os.path.join(dir_path, 'requirements.txt') for name, dir_path, status in nodes
+        if 'requirements.txt' in status['dependencies'] and os.path.exists(os.path.join(dir_path, 'requirements.txt'))
+    }
+    requirements = read_requirements(requirements_paths.values())
+    # Nodes whose requirements could not be installed, their install.py is not run
+    failed = set()
+    if requirements:
+        cache = load_cache()
+        key = hashlib.sha256("\n".join(requirements).encode('utf-8')).hexdigest()
+        if cache.get(key) == environment_fingerprint(*requirements_paths.values()):
+            log_('d', "Custom nodes requirements already satisfied")
+        else:
+            missing = missing_requirements(requirements)
+            if missing:
+                log_('d', f"{', '.join(missing)} not installed")
+            if missing and not await pip_install(requirements_paths.values()):
+                failed = set(requirements_paths)
+                if len(requirements_paths) > 1:
+                    # One unresolvable requirement fails the whole resolution, each node then gets its own
+                    log_('w', "Installing the requirements of each node separately")
+                    failed = {name for name, path in requirements_paths.items() if not await pip_install([path], name)}
+            if not failed:
+                # pip may have changed site-packages, remember the state that satisfies the set
+                save_cache(cache, key, environment_fingerprint(*requirements_paths.values()))
+    # install.py scripts run after pip, from their node directory, like ComfyUI-Manager does
+    for name, dir_path, status in nodes:
+        if name in failed:
+            log_('w', f"install.py of {name} not run, its requirements are not installed")
+        elif 'install.py' in status['dependencies'] and os.path.exists(os.path.join(dir_path, 'install.py')):
+            log_('i', f"Running install.py of {name}")
+            exit_status, output = await run_python(['install.py'], cwd=dir_path)
+            log_('d', output)
+            if exit_status != 0:
+                log_('e', f"install.py of {name} returned {exit_status}")
@@ -0,0 +1,118 @@
+import os
+import re
+import json
+from fnmatch import fnmatch
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.join(THIS_DIR, 'config.json')
+# Kind of each custom_nodes entry, with the modification times it was classified at
+DISCOVERY_CACHE = os.path.join(THIS_DIR, 'discovery_cache.json')
+# What an entry of custom_nodes can be, only the kinds listed in the update_kinds config get updated
+KINDS = ('repo', 'worktree', 'submodule', 'disabled', 'non-git', 'no-remote')
+
+from utils import initialize
+
+config, theme, console, log_ = initialize(CONFIG_PATH)
+
+
+def signature(dir_path):
+    # Changes when the directory gains or loses entries, or its git metadata or remotes change
+    stamps = []
+    for path in (dir_path, os.path.join(dir_path, '.git'), os.path.join(dir_path, '.git', 'config')):
+        try:
+            stamps.append(str(os.stat(path).st_mtime_ns))
+        except OSError:
+            stamps.append('-')
+    return ':'.join(stamps)
+
+
+def origin_url(config_path):
+    # url of [remote "origin"] in a git config file, read without running git
+    try:
+        with open(config_path, 'r', encoding='utf-8', errors='replace') as file:
+            lines = file.read().splitlines()
+    except OSError:
+        return None
+    in_origin = False
+    for line in lines:
+        line = line.strip()
+        if line.startswith('['):
+            in_origin = re.match(r'\[\s*remote\s+"origin"\s*\]', line) is not None
+        elif in_origin:
+            match = re.match(r'url\s*=\s*(.+)', line)
+            if match:
+                return match.group(1).strip().strip('"')
+    return None
+
+
+def classify(name, dir_path):
+    # Kind and origin URL of a custom_nodes entry, from the files in .git only
+    if name.endswith('.disabled') or name.startswith('.'):
+        return 'disabled', None # ComfyUI-Manager renames disabled nodes or moves them into .disabled
+    git_path = os.path.join(dir_path, '.git')
+    if os.path.isdir(git_path):
+        url = origin_url(os.path.join(git_path, 'config'))
+        return ('repo' if url else 'no-remote'), url
+    if not os.path.isfile(git_path):
+        return 'non-git', None
+    # A .git file points at the real git directory: a worktree or a submodule
+    try:
+        with open(git_path, 'r', encoding='utf-8') as file:
+            git_dir = file.read().strip().removeprefix('gitdir:').strip()
+    except OSError:
+        return 'non-git', None
+    git_dir = os.path.normpath(os.path.join(dir_path, git_dir))
+    # Only worktrees have a commondir file, pointing back at the main repository
+    kind, common_dir = 'submodule', git_dir
+    try:
+        with open(os.path.join(git_dir, 'commondir'), 'r', encoding='utf-8') as file:
+            kind, common_dir = 'worktree', os.path.normpath(os.path.join(git_dir, file.read().strip()))
+    except OSError:
+        pass
+    url = origin_url(os.path.join(common_dir, 'config'))
+    if not url:
+        return 'no-remote', None
+    return kind, url
+
+
+def load_cache():
+    try:
+        with open(DISCOVERY_CACHE, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def discover(custom_nodes_dir):
+    # Entries of custom_nodes worth updating in name order, and the names of the others by kind
+    # Entries whose signature did not change since the last run are not looked into again
+    cache = load_cache()
+    include = config.get('discovery_include') or []
+    exclude = config.get('discovery_exclude') or []
+    update_kinds = set(config.get('update_kinds', ['repo', 'worktree']))
+    entries, skipped, new_cache = [], {}, {}
+    for entry in sorted(os.scandir(custom_nodes_dir), key=lambda entry: entry.name.lower()):
+        if not entry.is_dir() or entry.name == "__pycache__":
+            continue
+        stamp = signature(entry.path)
+        cached = cache.get(entry.path)
+        if cached and cached['signature'] == stamp:
+            kind, url = cached['kind'], cached['url']
+        else:
+            kind, url = classify(entry.name, entry.path)
+        new_cache[entry.path] = {'signature': stamp, 'kind': kind, 'url': url}
+        if include and not any(fnmatch(entry.name, pattern) for pattern in include):
+            kind = 'excluded'
+        elif any(fnmatch(entry.name, pattern) for pattern in exclude):
+            kind = 'excluded'
+        if kind in update_kinds:
+            entries.append(entry)
+        else:
+            skipped.setdefault(kind, []).append(entry.name)
+    if new_cache != cache:
+        try:
+            with open(DISCOVERY_CACHE, 'w', encoding='utf-8') as file:
+                json.dump(new_cache, file, indent=4)
+        except OSError as e:
+            log_('w', f"Error saving discovery cache: {e}")
+    return entries, skipped
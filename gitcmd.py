@@ -0,0 +1,217 @@
+import os
+import re
+import signal
+import asyncio
+from asyncio.subprocess import DEVNULL, PIPE
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.join(THIS_DIR, 'config.json')
+# Seconds a cancelled git process gets to exit before it is killed
+TERMINATE_GRACE = 5
+# Network failures worth another try, anything else (authentication, missing repository, conflicts) is final
+TRANSIENT_ERRORS = re.compile(
+    r'Could not resolve host|Connection (timed out|reset|refused)|Operation timed out|Failed to connect'
+    r'|early EOF|remote end hung up|RPC failed|returned error: 5\d\d'
+    # Dropped TLS connections only, certificate problems are permanent
+    r'|SSL_ERROR_SYSCALL|SSL_read|gnutls_handshake\(\) failed|TLS connection was non-properly terminated',
+    re.IGNORECASE
+)
+
+from utils import initialize
+
+config, theme, console, log_ = initialize(CONFIG_PATH)
+
+# Repositories of each host whose network operation failed for good in this run
+_host_failures = {}
+
+
+class GitCommandError(Exception):
+    # Raised when a git command exits with a non-zero status
+    def __init__(self, command, status, stderr):
+        self.command = command
+        self.status = status
+        self.stderr = stderr.strip()
+        super().__init__(f"'{' '.join(command)}' returned {status}: {self.stderr}")
+
+
+class GitTimeoutError(GitCommandError):
+    # Raised when a git command runs longer than its timeout, the process is stopped first
+    def __init__(self, command, timeout):
+        self.command = command
+        self.status = None
+        self.stderr = f"timed out after {timeout}s"
+        Exception.__init__(self, f"'{' '.join(command)}' {self.stderr}")
+
+
+class HostUnavailableError(GitCommandError):
+    # Raised instead of contacting a host that kept failing during this run
+    def __init__(self, command, host):
+        self.command = command
+        self.status = None
+        self.stderr = f"{host} skipped after {config.get('circuit_breaker_threshold', 3)} repositories failed on it"
+        Exception.__init__(self, f"'{' '.join(command)}' not run: {self.stderr}")
+
+
+async def _read_stream(stream, lines, on_line, separator):
+    # Split the stream into lines as data arrives and hand each one to on_line
+    pending = ''
+    while True:
+        chunk = await stream.read(4096)
+        if not chunk:
+            break
+        pending += chunk.decode('utf-8', errors='replace')
+        *complete, pending = re.split(separator, pending)
+        for line in complete:
+            lines.append(line)
+            if on_line:
+                on_line(line)
+    if pending:
+        lines.append(pending)
+        if on_line:
+            on_line(pending)
+
+
+async def _terminate(process):
+    # Stop a git process whose caller was cancelled, killing it if it does not exit in time
+    if process.returncode is not None:
+        return
+    try:
+        _signal(process, signal.SIGTERM)
+        await asyncio.wait_for(process.wait(), TERMINATE_GRACE)
+    except ProcessLookupError:
+        pass
+    except asyncio.TimeoutError:
+        _signal(process, signal.SIGKILL if os.name == 'posix' else signal.SIGTERM)
+        await process.wait()
+
+
+def _signal(process, signum):
+    # On POSIX git runs in its own process group, so ssh and credential helpers it started stop with it
+    if os.name == 'posix':
+        os.killpg(process.pid, signum)
+    elif signum == signal.SIGTERM:
+        process.terminate()
+
+
+async def run_git(*args, cwd=None, on_stdout=None, on_stderr=None, timeout=None):
+    # Run a git command without blocking the event loop and return its stdout
+    command = ['git', *args]
+    env = os.environ.copy()
+    if cwd:
+        # custom_nodes lives inside the ComfyUI checkout, never fall back to the enclosing repository
+        env['GIT_CEILING_DIRECTORIES'] = os.path.dirname(os.path.abspath(cwd))
+    # Nobody answers credential prompts here, fail instead of waiting forever
+    env['GIT_TERMINAL_PROMPT'] = '0'
+    env.setdefault('GCM_INTERACTIVE', 'never')
+    process = await asyncio.create_subprocess_exec(
+        *command, cwd=cwd, env=env, stdin=DEVNULL, stdout=PIPE, stderr=PIPE, start_new_session=os.name == 'posix'
+    )
+    stdout, stderr = [], []
+
+    async def communicate():
+        await asyncio.gather(
+            _read_stream(process.stdout, stdout, on_stdout, r'\n'),
+            # git progress meters rewrite their line with carriage returns
+            _read_stream(process.stderr, stderr, on_stderr, r'\r\n|\r|\n'),
+        )
+        return await process.wait()
+
+    try:
+        status = await asyncio.wait_for(communicate(), timeout or None)
+    except asyncio.TimeoutError:
+        await _terminate(process)
+        raise GitTimeoutError(command, timeout)
+    except asyncio.CancelledError:
+        await _terminate(process)
+        raise
+    if status != 0:
+        raise GitCommandError(command, status, '\n'.join(stderr))
+    return '\n'.join(stdout).strip()
+
+
+def host_of(url):
+    # github.com for https://github.com/a/b and git@github.com:a/b, local for paths and file:// URLs
+    match = (
+        re.match(r'^[a-z][a-z0-9+.-]*://(?:[^@/]*@)?([^/:]+)', url, re.IGNORECASE)
+        or re.match(r'^(?:[^@/]+@)?([^/:\\]{2,}):(?!/)', url)
+    )
+    return match.group(1).lower() if match else 'local'
+
+
+def reset_hosts():
+    # Forget past failures, called at the start of each run
+    _host_failures.clear()
+
+
+async def run_remote_git(url, *args, cwd=None, on_stdout=None, on_stderr=None):
+    # run_git for commands that talk to url: timeout per operation, retries with backoff on network failures,
+    # and hosts on which several repositories failed within a run are skipped
+    command, host = ['git', *args], host_of(url)
+    repository = os.path.abspath(cwd) if cwd else url
+    threshold = int(config.get('circuit_breaker_threshold', 3))
+    timeout = config.get('git_timeouts', {}).get(args[0])
+    retries = int(config.get('git_retries', 2))
+    if threshold and len(_host_failures.get(host, ())) >= threshold:
+        raise HostUnavailableError(command, host)
+    for attempt in range(retries + 1):
+        try:
+            output = await run_git(*args, cwd=cwd, on_stdout=on_stdout, on_stderr=on_stderr, timeout=timeout)
+            _host_failures.pop(host, None) # The host answers, earlier failures were about their repositories
+            return output
+        except GitCommandError as e:
+            if not isinstance(e, GitTimeoutError) and not TRANSIENT_ERRORS.search(e.stderr):
+                raise
+            if attempt == retries:
+                # One failure per repository, a single slow repository cannot trip the breaker on its own
+                _host_failures.setdefault(host, set()).add(repository)
+                raise
+            delay = float(config.get('git_retry_backoff', 2)) * 2 ** attempt
+            log_('d', "%s failed (%s), retrying in %ss", ' '.join(command), e.stderr, delay)
+            await asyncio.sleep(delay)
+
+
+async def is_partial(dir_path):
+    # Whether the repository was cloned or fetched with a filter, its missing objects are fetched on demand
+    # Recent git marks the promisor remote, older versions set extensions.partialClone
+    try:
+        settings = await run_git('config', '--get-regexp', r'^(remote\..*\.promisor|extensions\.partialclone)$', cwd=dir_path)
+    except GitCommandError:
+        return False
+    return any(line.split(' ', 1)[-1] != 'false' for line in settings.splitlines())
+
+
+async def run_lazy_git(*args, cwd=None, on_stdout=None, on_stderr=None):
+    # run_git for local commands that read blobs, in a partial clone the missing ones come from the remote
+    # They then get the timeout of their command, a dead host must not hang them
+    timeout = config.get('git_timeouts', {}).get(args[0]) if await is_partial(cwd) else None
+    return await run_git(*args, cwd=cwd, on_stdout=on_stdout, on_stderr=on_stderr, timeout=timeout)
+
+
+async def upstream(dir_path):
+    # (remote, remote branch, tracking ref) followed by the checked out branch, None on a detached HEAD
+    # Raises GitCommandError when the branch has no upstream
+    try:
+        branch = await run_git('symbolic-ref', '-q', '--short', 'HEAD', cwd=dir_path)
+    except GitCommandError:
+        return None
+    remote = await run_git('config', '--get', f'branch.{branch}.remote', cwd=dir_path)
+    merge = await run_git('config', '--get', f'branch.{branch}.merge', cwd=dir_path)
+    tracking = await run_git('rev-parse', '--symbolic-full-name', '@{upstream}', cwd=dir_path)
+    return remote, merge.removeprefix('refs/heads/'), tracking
+
+
+async def fetch_options(dir_path, filters=True):
+    # Extra fetch arguments so that only the commits newer than HEAD, and with a filter only their trees, are downloaded
+    options = []
+    if config.get('shallow_fetch'):
+        # Full clones keep their whole history unless converting them is allowed, --shallow-since would cut it
+        shallow = await run_git('rev-parse', '--is-shallow-repository', cwd=dir_path) == 'true'
+        if shallow or config.get('convert_to_shallow'):
+            # One second before HEAD keeps HEAD in the fetched history, so the new tip still fast-forwards from it
+            head_time = int(await run_git('log', '-1', '--format=%ct', 'HEAD', cwd=dir_path))
+            options.append(f'--shallow-since=@{head_time - 1}')
+    if filters and config.get('fetch_filter'):
+        # Full clones keep fetching everything unless converting them is allowed, the blobs they hold stay until repacked
+        if await is_partial(dir_path) or config.get('convert_to_partial'):
+            options.append(f"--filter={config['fetch_filter']}")
+    return options
@@ -0,0 +1,118 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+COMFYUI = os.path.join(THIS_DIR, '../..')
+CONFIG_PATH = os.path.join(THIS_DIR, 'config.json')
+# One lockfile per update run, with the commit of every repository before and after it
+LOCKS_DIR = os.path.join(THIS_DIR, 'locks')
+LOCKS_KEPT = 20
+
+from utils import initialize
+from gitcmd import run_git, run_remote_git, GitCommandError
+
+config, theme, console, log_ = initialize(CONFIG_PATH)
+
+
+def build_lockfile(results, started):
+    # results are (name, directory, status) tuples, repositories whose commit is unknown are left out
+    repos = {}
+    for name, dir_path, status in results:
+        if not status.get('before') or status['url'] == dir_path:
+            continue
+        repos[name] = {
+            'url': status['url'],
+            'path': os.path.relpath(dir_path, COMFYUI).replace(os.sep, '/'), # Relative to ComfyUI, installs can live anywhere
+            'before': status['before'],
+            'after': status.get('after') or status['before'], # Unchanged when the pull was skipped, HEAD as it was left when it failed
+        }
+    return {'started': started.isoformat(timespec='seconds'), 'repos': repos}
+
+
+def write_lockfile(results, started):
+    if not config.get('lockfile', True):
+        return
+    try:
+        os.makedirs(LOCKS_DIR, exist_ok=True)
+        lock_path = os.path.join(LOCKS_DIR, f"lock-{started.strftime('%Y-%m-%d_%Hh%Mm%Ss')}.json")
+        with open(lock_path, 'w', encoding='utf-8') as file:
+            json.dump(build_lockfile(results, started), file, ensure_ascii=False, indent=4)
+        log_('d', f"Lockfile written to {lock_path}")
+        # Keep only the most recent lockfiles
+        for old_lock in sorted(os.listdir(LOCKS_DIR), reverse=True)[LOCKS_KEPT:]:
+            os.remove(os.path.join(LOCKS_DIR, old_lock))
+    except OSError as e:
+        log_('e', f"Error writing lockfile: {e}")
+
+
+def latest_lockfile():
+    locks = sorted(os.listdir(LOCKS_DIR)) if os.path.isdir(LOCKS_DIR) else []
+    return os.path.join(LOCKS_DIR, locks[-1]) if locks else None
+
+
+async def sync_repo(name, repo, target):
+    # Bring one repository to target, returns what was done: "at target", "synced", "cloned" or an error
+    dir_path = os.path.normpath(os.path.join(COMFYUI, repo['path']))
+    try:
+        # A missing repository is cloned on its default branch, which keeps its upstream so that later updates still apply
+        cloned = not os.path.exists(dir_path)
+        if cloned:
+            await run_remote_git(repo['url'], 'clone', '--quiet', repo['url'], dir_path)
+        if await run_git('rev-parse', 'HEAD', cwd=dir_path) == target:
+            return "cloned" if cloned else "at target"
+        try:
+            await run_git('cat-file', '-e', f'{target}^{{commit}}', cwd=dir_path)
+        except GitCommandError:
+            # Only fetch when the commit is missing, by SHA first so that no other history comes along
+            try:
+                await run_remote_git(repo['url'], 'fetch', '--quiet', 'origin', target, cwd=dir_path)
+            except GitCommandError:
+                await run_remote_git(repo['url'], 'fetch', '--quiet', 'origin', cwd=dir_path)
+        # Keeps local changes unless they touch files that differ, in which case nothing is changed
+        await run_git('reset', '--keep', target, cwd=dir_path)
+        return "cloned" if cloned else "synced"
+    except (GitCommandError, OSError) as e:
+        return f"error: {e}"
+
+
+async def sync(lock_path, state='after'):
+    # Bring every repository of a lockfile to its before or after commit, jobs at a time
+    with open(lock_path, 'r', encoding='utf-8') as file:
+        repos = json.load(file)['repos']
+    jobs = asyncio.Semaphore(max(1, int(config.get('jobs', 1))))
+
+    async def sync_one(name, repo):
+        async with jobs:
+            return await sync_repo(name, repo, repo[state])
+
+    outcomes = await asyncio.gather(*(sync_one(name, repo) for name, repo in repos.items()))
+    for name, outcome in zip(repos, outcomes):
+        if outcome.startswith("error"):
+            log_('e', f"{name}: {outcome}")
+        elif outcome != "at target":
+            log_('w', f"{name}: {outcome} to {repos[name][state][:7]}")
+    counts = {outcome: outcomes.count(outcome) for outcome in ("at target", "synced", "cloned")}
+    errors = len(outcomes) - sum(counts.values())
+    console.print(f"{counts['synced']} synced, {counts['cloned']} cloned, {counts['at target']} already at target, {errors} failed", style='info')
+    return errors == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bring ComfyUI and its custom nodes to the commits of an update lockfile")
+    parser.add_argument('lockfile', nargs='?', help="lockfile to sync to, the most recent one in locks/ by default")
+    parser.add_argument('--state', choices=['before', 'after'], default='after',
+                        help="'before' rolls back the update of that run, 'after' restores its result")
+    args = parser.parse_args()
+    lock_path = args.lockfile or latest_lockfile()
+    if not lock_path:
+        log_('e', f"No lockfile found in {LOCKS_DIR}")
+        sys.exit(1)
+    console.print(f"Syncing to the {args.state} state of {lock_path}", style='info')
+    sys.exit(0 if asyncio.run(sync(lock_path, args.state)) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import os
+import re
+import asyncio
+import hashlib
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.join(THIS_DIR, 'config.json')
+
+from utils import initialize
+from gitcmd import run_git, run_remote_git, fetch_options, is_partial, GitCommandError
+
+config, theme, console, log_ = initialize(CONFIG_PATH)
+
+# Mirrors already fetched by this process, with a lock each so that concurrent jobs fetch a mirror once
+_fetched = {}
+_locks = {}
+
+
+def reset_mirrors():
+    # Forget which mirrors were fetched, a new pass of a long running process fetches them again
+    _fetched.clear()
+
+
+def mirror_dir():
+    # Shared between installations, empty when mirrors are disabled
+    return os.path.expanduser(config.get('mirror_dir') or "")
+
+
+def mirror_path(url):
+    # Bare repository of a remote URL, named after the repository and a hash of the normalized URL
+    normalized = re.sub(r'(\.git)?/*$', '', url.strip()).lower()
+    name = re.sub(r'[^A-Za-z0-9._-]', '_', normalized.split('/')[-1]) or 'repo'
+    digest = hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(mirror_dir(), f"{name}-{digest}.git")
+
+
+async def create_mirror(url, path):
+    # Only branches and tags are mirrored, pull request refs would bloat it
+    await run_git('init', '--quiet', '--bare', path)
+    await run_git('remote', 'add', 'origin', url, cwd=path)
+    await run_git('config', 'remote.origin.fetch', '+refs/heads/*:refs/heads/*', cwd=path)
+    await run_git('config', '--add', 'remote.origin.fetch', '+refs/tags/*:refs/tags/*', cwd=path)
+    # Installations borrow objects from the mirror, it must never prune them
+    await run_git('config', 'gc.pruneExpire', 'never', cwd=path)
+    await run_git('config', 'gc.auto', '0', cwd=path)
+
+
+async def update_mirror(url):
+    # Fetch url into its mirror once per pass, returns the mirror path or None if it cannot be used
+    if not mirror_dir():
+        return None
+    path = mirror_path(url)
+    # Locks belong to an event loop, the benchmark runs several
+    lock = _locks.setdefault((asyncio.get_running_loop(), path), asyncio.Lock())
+    async with lock:
+        if path not in _fetched:
+            try:
+                if not os.path.exists(os.path.join(path, 'HEAD')):
+                    os.makedirs(mirror_dir(), exist_ok=True)
+                    await create_mirror(url, path)
+                await run_remote_git(url, 'fetch', '--quiet', '--prune', 'origin', cwd=path)
+                _fetched[path] = True
+            except (GitCommandError, OSError) as e:
+                # Another installation may be fetching it right now, the repository fetches on its own
+                log_('d', f"Mirror of {url} not updated: {e}")
+                _fetched[path] = os.path.exists(os.path.join(path, 'objects'))
+        return path if _fetched[path] else None
+
+
+async def borrow_objects(dir_path, mirror):
+    # Point the repository at the mirror objects through alternates, fetches then only transfer what the mirror lacks
+    git_dir = await run_git('rev-parse', '--absolute-git-dir', cwd=dir_path)
+    alternates_path = os.path.join(git_dir, 'objects', 'info', 'alternates')
+    mirror_objects = os.path.join(os.path.abspath(mirror), 'objects')
+    alternates = []
+    if os.path.exists(alternates_path):
+        with open(alternates_path, 'r', encoding='utf-8') as file:
+            alternates = file.read().splitlines()
+    if mirror_objects not in alternates:
+        os.makedirs(os.path.dirname(alternates_path), exist_ok=True)
+        with open(alternates_path, 'a', encoding='utf-8') as file:
+            file.write(mirror_objects + "\n")
+
+
+async def reduced_history(dir_path):
+    # Shallow and partial repositories, and those the next fetch converts, hold less than the full history of a mirror
+    if await fetch_options(dir_path):
+        return True
+    return await run_git('rev-parse', '--is-shallow-repository', cwd=dir_path) == 'true' or await is_partial(dir_path)
+
+
+async def use_mirror(dir_path, url):
+    # Bring the mirror of url up to date and make dir_path use it, a no-op when mirrors are disabled
+    # Filling a mirror would download the history and blobs that shallow and partial repositories avoid, they go without
+    if not mirror_dir() or await reduced_history(dir_path):
+        return None
+    mirror = await update_mirror(url)
+    if mirror:
+        await borrow_objects(dir_path, mirror)
+    return mirror
@@ -0,0 +1,87 @@
+import os
+import time
+import asyncio
+import argparse
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.join(THIS_DIR, 'config.json')
+
+from utils import initialize
+from gitcmd import run_git, run_remote_git, reset_hosts, fetch_options, upstream, GitCommandError
+from mirror import use_mirror, reset_mirrors
+from repo_state import repositories, load_state, save_state
+
+config, theme, console, log_ = initialize(CONFIG_PATH)
+
+
+async def prefetch_repo(dir_path):
+    # Fetch the upstream of the checked out branch into its remote-tracking ref, the working tree and HEAD are left alone
+    now = time.time()
+    entry = {'fetched_at': now, 'local_checked_at': now, 'remote_checked_at': now}
+    try:
+        local_sha = await run_git('rev-parse', 'HEAD', cwd=dir_path)
+        tracked = await upstream(dir_path)
+        if tracked is None:
+            # A detached HEAD is pinned, update() leaves it alone so there is nothing to prefetch
+            entry.update(url=await run_git('remote', 'get-url', 'origin', cwd=dir_path), local_sha=local_sha, new_commits=0)
+            return entry
+        remote, branch, tracking_ref = tracked
+        url = await run_git('remote', 'get-url', remote, cwd=dir_path)
+        await use_mirror(dir_path, url)
+        await run_remote_git(url, 'fetch', '--quiet', *await fetch_options(dir_path), remote, branch, cwd=dir_path)
+        remote_sha = await run_git('rev-parse', tracking_ref, cwd=dir_path)
+        # Commits waiting to be applied by the next update
+        new_commits = int(await run_git('rev-list', '--count', f'{local_sha}..{remote_sha}', cwd=dir_path))
+        entry.update(url=url, branch=branch, remote_sha=remote_sha, local_sha=local_sha, new_commits=new_commits)
+    except (GitCommandError, ValueError, OSError) as e:
+        entry['error'] = str(e)
+    return entry
+
+
+async def prefetch():
+    # One pass over every repository, jobs at a time, returns the new state
+    reset_hosts()
+    reset_mirrors()
+    jobs = asyncio.Semaphore(max(1, int(config.get('jobs', 1))))
+    paths = repositories()
+
+    async def prefetch_one(dir_path):
+        async with jobs:
+            return await prefetch_repo(dir_path)
+
+    entries = await asyncio.gather(*(prefetch_one(path) for path in paths))
+    # Re-read as update() may have written it meanwhile, repositories removed since are dropped
+    previous = load_state()
+    state = {}
+    for path, entry in zip(paths, entries):
+        state[os.path.abspath(path)] = {key: value for key, value in previous.get(os.path.abspath(path), {}).items() if key != 'error'}
+        state[os.path.abspath(path)].update(entry)
+    save_state(state)
+    pending = [os.path.basename(path) for path, entry in state.items() if entry.get('new_commits')]
+    errors = sum('error' in entry for entry in state.values())
+    log_('i', f"Prefetched {len(state)} repositories, {len(pending)} with new commits{': ' + ', '.join(pending) if pending else ''}, {errors} failed")
+    return state
+
+
+async def run(interval):
+    # Prefetch every interval minutes until stopped, or once if interval is 0
+    while True:
+        await prefetch()
+        if not interval:
+            break
+        await asyncio.sleep(interval * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch every repository in the background so that launch-time updates stay local")
+    parser.add_argument('--once', action='store_true', help="prefetch once and exit, for cron or a systemd timer")
+    parser.add_argument('--interval', type=float, default=config.get('prefetch_interval', 60), help="minutes between two passes")
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(0 if args.once else args.interval))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
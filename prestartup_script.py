@@ -12,8 +12,7 @@ STARSTRACKER = os.path.join(THIS_DIR, 'Starstracker.json')
 CONFIG_PATH = os.path.join(THIS_DIR, 'config.json')
 REQUIREMENTS_PATH = os.path.join(THIS_DIR, 'requirements.txt')
 
-from starstracker import starstracker, display_starstracker, clone_repo
-from utils import menu, initialize, requirements_installer, log_
+from utils import menu, ask, initialize, requirements_installer, log_
 
 config, theme, console, log_ = initialize(CONFIG_PATH)
 requirements_installer(REQUIREMENTS_PATH)
@@ -40,14 +39,20 @@ async def display_timer(timeout_duration, config):
 
 
 async def main():
-    # Initialize main menu index
-    node_index = 0
     menu_items = ['Trending Nodes', 'Update All', 'Run ComfyUI']
-    menu_items_st = ['Next', 'Install', 'Back']
+    menu_items_st = ['Next', 'Previous', 'Mark', 'Install', 'Search', 'Jump', 'Back']
+    browser_keys = {'pagedown': 'page down', 'pageup': 'page up'}
     choice_index = 0
     menu_loop = True
     timer = True
 
+    # Start right away when the last update or prefetch left nothing to apply
+    if config.get('skip_menu_when_up_to_date'):
+        from repo_state import updates_pending
+        if not updates_pending():
+            console.print("Everything is up to date, starting ComfyUI", style='up_to_date')
+            return
+
     # Main menu loop
     while menu_loop:
         try:
@@ -79,28 +84,46 @@ async def main():
         elif choice == 'trending nodes':
             timer = False
             log_('d', "Executing install choice")
+            from starstracker import starstracker, install_repos
+            from browser import TrendingBrowser
             await starstracker()
             try:
-                # Load and display nodes from Starstracker.json
-                with open(STARSTRACKER, 'r', encoding='utf-8') as file:
-                    nodes = json.load(file)
-                    node_index = 0 
-                    # Loop through the nodes for installation
-                    while node_index < len(nodes):
-                        await display_starstracker(node_index, config)
-                        choice_index_st = await menu(menu_items_st, config)
-                        choice_st = menu_items_st[choice_index_st].lower()
-                        if choice_st == 'next':
-                            node_index += 1
-                        elif choice_st == 'install':
-                            # Install selected node
-                            url = nodes[node_index].get('url', 'Unknown')
-                            await clone_repo(url, CUSTOM_NODES_DIR)
-                        elif choice_st == 'back':
-                            timer = False
-                            break
+                # Load the ranked nodes from Starstracker.json once
+                browser = TrendingBrowser(STARSTRACKER, config, console)
             except (FileNotFoundError, json.JSONDecodeError) as e:
                 log_('e', f"Error loading Starstracker.json: {e}")
+                continue
+            # Loop through the nodes for installation
+            while browser.nodes:
+                browser.show()
+                choice_st = await menu(menu_items_st, config, browser_keys)
+                if isinstance(choice_st, int):
+                    choice_st = menu_items_st[choice_st].lower()
+                if choice_st == 'next':
+                    if not browser.move(1):
+                        break
+                elif choice_st == 'previous':
+                    browser.move(-1)
+                elif choice_st in ('page down', 'page up'):
+                    browser.page(1 if choice_st == 'page down' else -1)
+                elif choice_st == 'search':
+                    text = await ask("Search: ")
+                    if text and not browser.search(text):
+                        log_('w', f"No node matches '{text}'")
+                elif choice_st == 'jump':
+                    position = await ask(f"Jump to (1-{len(browser.nodes)}): ")
+                    if position and position.strip().isdigit():
+                        browser.jump(int(position))
+                elif choice_st == 'mark':
+                    browser.toggle_mark()
+                elif choice_st == 'install':
+                    # Install the marked nodes in parallel, or the current one
+                    await install_repos(browser.install_urls(), CUSTOM_NODES_DIR)
+                    browser.marked.clear()
+                else:
+                    # Back or Escape
+                    break
+            browser.close()
             continue
         break
         
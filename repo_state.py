@@ -0,0 +1,90 @@
+import os
+import json
+import time
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+COMFYUI = os.path.join(THIS_DIR, '../..')
+CUSTOM_NODES_DIR = os.path.join(COMFYUI, 'custom_nodes')
+CONFIG_PATH = os.path.join(THIS_DIR, 'config.json')
+# Last known local and remote commit of each repository, keyed by its absolute path
+# local_checked_at and remote_checked_at say when each was read, fetched_at when a prefetch last filled the tracking ref
+REPO_STATE = os.path.join(THIS_DIR, 'repo_state.json')
+
+from utils import initialize
+from discovery import discover
+
+config, theme, console, log_ = initialize(CONFIG_PATH)
+
+# Last state read by fresh_entry, with the modification time it was read at
+_state_cache = (None, {})
+
+
+def repositories():
+    # ComfyUI and its custom nodes, the same set update() goes through
+    return [COMFYUI] + [entry.path for entry in discover(CUSTOM_NODES_DIR)[0]]
+
+
+def load_state():
+    try:
+        with open(REPO_STATE, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_state(state):
+    # Written aside then renamed, the prefetcher and update() may read it at any time
+    try:
+        with open(REPO_STATE + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(state, file, indent=4)
+        os.replace(REPO_STATE + '.tmp', REPO_STATE)
+    except OSError as e:
+        log_('e', f"Error saving repository state: {e}")
+
+
+def fresh_entry(dir_path):
+    # State of a repository, if prefetched recently enough for its tracking ref to stand in for the remote
+    global _state_cache
+    max_age = float(config.get('prefetch_max_age', 0)) * 60
+    if not max_age:
+        return None
+    try:
+        mtime = os.stat(REPO_STATE).st_mtime_ns
+    except OSError:
+        return None
+    if _state_cache[0] != mtime:
+        _state_cache = (mtime, load_state())
+    entry = _state_cache[1].get(os.path.abspath(dir_path))
+    if entry and 'error' not in entry and time.time() - entry.get('fetched_at', 0) < max_age:
+        return entry
+    return None
+
+
+def record_update(results):
+    # After update() every repository that did not fail matches its remote, results are (name, directory, status) tuples
+    state = load_state()
+    now = time.time()
+    for name, dir_path, status in results:
+        entry = state.setdefault(os.path.abspath(dir_path), {})
+        entry.update(local_checked_at=now, remote_checked_at=now)
+        if status['flag'] == "error":
+            entry['error'] = status['infos']
+            continue
+        entry.pop('error', None)
+        local_sha = status.get('after') or status['before']
+        entry.update(url=status['url'], local_sha=local_sha, remote_sha=local_sha, new_commits=0)
+    save_state(state)
+
+
+def updates_pending():
+    # Whether the menu is worth showing: known new commits, a failed update or prefetch, or no recent enough knowledge of some repository
+    # Only reads the state file and lists custom_nodes, git is not run
+    state = load_state()
+    oldest = time.time() - float(config.get('state_ttl', 720)) * 60
+    for dir_path in repositories():
+        entry = state.get(os.path.abspath(dir_path))
+        if entry is None or entry.get('remote_checked_at', 0) < oldest:
+            return True
+        if entry.get('new_commits') or 'error' in entry:
+            return True
+    return False
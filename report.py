@@ -0,0 +1,108 @@
+import os
+import json
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.join(THIS_DIR, 'config.json')
+REPORTS_DIR = os.path.join(THIS_DIR, 'reports')
+REPORTS_KEPT = 10
+
+from utils import initialize
+
+config, theme, console, log_ = initialize(CONFIG_PATH)
+
+
+def build_report(results, started, duration, discovery):
+    # Machine-readable summary of an update run, results are (name, directory, status) tuples
+    repos = []
+    totals = {'repos': len(results), 'UTD': 0, 'outdated': 0, 'error': 0, 'bytes_fetched': 0, 'paths': {}}
+    for name, dir_path, status in results:
+        totals[status['flag']] = totals.get(status['flag'], 0) + 1
+        totals['bytes_fetched'] += status.get('bytes_fetched', 0)
+        if status['path']:
+            totals['paths'][status['path']] = totals['paths'].get(status['path'], 0) + 1
+        repo = {
+            'name': name,
+            'dir': os.path.abspath(dir_path),
+            'url': status['url'],
+            'outcome': status['flag'],
+            'update_path': status['path'],
+            'timings': {phase: round(seconds, 4) for phase, seconds in status.get('timings', {}).items()},
+            'bytes_fetched': status.get('bytes_fetched', 0),
+        }
+        if status['flag'] == "error":
+            repo['error'] = status['infos']
+        repos.append(repo)
+    return {
+        'started': started.isoformat(timespec='seconds'),
+        'duration': round(duration, 4),
+        'discovery': round(discovery, 4),
+        'jobs': config.get('jobs', 1),
+        'totals': totals,
+        'repos': repos,
+    }
+
+
+def prometheus_text(report, timestamp):
+    # Same data in the Prometheus text exposition format, for node_exporter's textfile collector
+    def label(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    lines = [
+        "# HELP up2date_repo_phase_seconds Time spent in each update phase of a repository during the last run.",
+        "# TYPE up2date_repo_phase_seconds gauge",
+    ]
+    for repo in report['repos']:
+        for phase, seconds in repo['timings'].items():
+            lines.append(f'up2date_repo_phase_seconds{{repo="{label(repo["name"])}",phase="{phase}"}} {seconds}')
+    lines += [
+        "# HELP up2date_repo_fetched_bytes Bytes added to the object database of a repository during the last run.",
+        "# TYPE up2date_repo_fetched_bytes gauge",
+    ]
+    lines += [f'up2date_repo_fetched_bytes{{repo="{label(repo["name"])}"}} {repo["bytes_fetched"]}' for repo in report['repos']]
+    lines += [
+        "# HELP up2date_repo_outcome Outcome of the last run for a repository (UTD, outdated or error).",
+        "# TYPE up2date_repo_outcome gauge",
+    ]
+    lines += [f'up2date_repo_outcome{{repo="{label(repo["name"])}",outcome="{repo["outcome"]}"}} 1' for repo in report['repos']]
+    lines += [
+        "# HELP up2date_run_repos Repositories per outcome in the last run.",
+        "# TYPE up2date_run_repos gauge",
+    ]
+    lines += [f'up2date_run_repos{{outcome="{outcome}"}} {report["totals"][outcome]}' for outcome in ('UTD', 'outdated', 'error')]
+    lines += [
+        "# HELP up2date_run_duration_seconds Wall time of the last update run.",
+        "# TYPE up2date_run_duration_seconds gauge",
+        f"up2date_run_duration_seconds {report['duration']}",
+        "# HELP up2date_run_fetched_bytes Bytes fetched over all repositories in the last run.",
+        "# TYPE up2date_run_fetched_bytes gauge",
+        f"up2date_run_fetched_bytes {report['totals']['bytes_fetched']}",
+        "# HELP up2date_last_run_timestamp_seconds Unix time the last update run started.",
+        "# TYPE up2date_last_run_timestamp_seconds gauge",
+        f"up2date_last_run_timestamp_seconds {timestamp:.0f}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def write_report(results, started, duration, discovery):
+    # Write reports/update-<time>.json, and the Prometheus textfile if configured
+    if not config.get('report', True) and not config.get('prometheus_textfile'):
+        return
+    report = build_report(results, started, duration, discovery)
+    try:
+        if config.get('report', True):
+            os.makedirs(REPORTS_DIR, exist_ok=True)
+            report_path = os.path.join(REPORTS_DIR, f"update-{started.strftime('%Y-%m-%d_%Hh%Mm%Ss')}.json")
+            with open(report_path, 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=4)
+            log_('d', f"Run report written to {report_path}")
+            # Keep only the most recent reports
+            for old_report in sorted(os.listdir(REPORTS_DIR), reverse=True)[REPORTS_KEPT:]:
+                os.remove(os.path.join(REPORTS_DIR, old_report))
+        textfile = config.get('prometheus_textfile')
+        if textfile:
+            # Written aside then renamed, so the collector never reads a partial file
+            with open(textfile + '.tmp', 'w', encoding='utf-8') as file:
+                file.write(prometheus_text(report, started.timestamp()))
+            os.replace(textfile + '.tmp', textfile)
+    except OSError as e:
+        log_('e', f"Error writing run report: {e}")
@@ -1,8 +1,11 @@
+import re
 import json
-import math
 import os
-import subprocess
-from datetime import datetime, timedelta
+import sqlite3
+import asyncio
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+import numpy as np
 from rich.text import Text
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -14,8 +17,20 @@ CONFIG_PATH = os.path.join(THIS_DIR, 'config.json')
 STARSTRACKER = os.path.join(THIS_DIR, 'Starstracker.json')
 GITHUB_STATS_PATH = os.path.join(MANAGER_DIR, 'github-stats.json')
 CUSTOM_NODE_LIST_PATH = os.path.join(MANAGER_DIR, 'custom-node-list.json')
+# custom-node-list.json as an SQLite table keyed by repository URL
+NODE_INDEX = os.path.join(THIS_DIR, 'custom_nodes_index.sqlite')
+# Compact star counts of past github-stats.json versions, one file per ComfyUI-Manager commit
+STARS_CACHE_DIR = os.path.join(THIS_DIR, 'stars_cache')
+STARS_CACHE_SIZE = 60
+# Daily star counts, a JSON index of days and URLs plus an int32 matrix of shape (days, urls)
+STARS_SERIES_DIR = os.path.join(THIS_DIR, 'stars_series')
+SERIES_INDEX = os.path.join(STARS_SERIES_DIR, 'index.json')
+SERIES_DATA = os.path.join(STARS_SERIES_DIR, 'stars.bin')
+MISSING = -1 # Star count of a repository not listed on that day
 
 from utils import markdown_fixer, name_prettifier, parse_markdown, initialize
+from gitcmd import run_git, run_remote_git, GitCommandError
+from mirror import update_mirror
 nodes = []
 config, theme, console, log_ = initialize(CONFIG_PATH)
 
@@ -24,19 +39,6 @@ async def starstracker():
     global starstracker_called
     starstracker_called = True
 
-    # Load custom node list
-    try:
-        with open(CUSTOM_NODE_LIST_PATH, 'r', encoding='utf-8') as alter_file:
-            custom_node_list = {
-                node['reference']: {
-                    'title': node['title'],
-                    'description': node['description']
-                } for node in json.load(alter_file).get('custom_nodes', [])
-            }
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        log_('e', f"Error loading custom node list: {e}")
-        return
-    
     installed_nodes = {node for node in os.listdir(CUSTOM_NODES_DIR) if os.path.isdir(os.path.join(CUSTOM_NODES_DIR, node))}
 
     # Load current GitHub stats
@@ -47,88 +49,271 @@ async def starstracker():
         log_('e', f"Error loading GitHub stats: {e}")
         return
 
-    target_date = (datetime.now() - timedelta(config['days_ago'])).replace(tzinfo=None)
-    os.chdir(MANAGER_DIR)
-
-    # Retrieve previous GitHub stats data from the relevant commit
+    # Bring the daily star history up to date with ComfyUI-Manager
     try:
-        result = subprocess.run(['git', 'log', '--pretty=format:%H %cI'], capture_output=True, text=True, check=True)
-        commits = result.stdout.splitlines()
-        previous_commit_hash = next(
-            (hash for hash, date_str in (commit.split() for commit in commits)
-             if datetime.fromisoformat(date_str.rstrip('Z')).replace(tzinfo=None) <= target_date), commits[-1].split()[0]
-        )
-
-        result = subprocess.run(['git', 'show', f'{previous_commit_hash}:{os.path.basename(GITHUB_STATS_PATH)}'], capture_output=True, text=True, check=True)
-        previous_data = json.loads(result.stdout)
-    except (subprocess.CalledProcessError, json.JSONDecodeError) as e:
+        series = await update_series()
+    except (GitCommandError, json.JSONDecodeError, OSError) as e:
         log_('e', f"Error retrieving data from commit: {e}")
         return
+    if not series[0]['days']:
+        log_('e', "No github-stats.json history found in ComfyUI-Manager")
+        return
 
-    starstracker_data = []
+    columns = load_columns(current_data, series, installed_nodes)
+    winners, scores = rank(columns, config)
 
-    # Process each node for star statistics
-    for url, details in current_data.items():
-        total_stars = details.get("stars", 0)
-        new_stars = total_stars - previous_data.get(url, {}).get("stars", 0)
-        last_update_str = details.get("last_update", "1970-01-01 00:00:00")
-        try:
-            last_update = datetime.strptime(last_update_str, "%Y-%m-%d %H:%M:%S")
-        except ValueError:
-            last_update = datetime(1970, 1, 1)  # Fallback date in case of parsing issues
-        days_since_update = (datetime.now() - last_update).days
-
-        if url in previous_data and url.split('/')[-1] not in installed_nodes and url not in config['excluded_repos'] and new_stars >= config['minimum_new_stars']:
-            
-            trend_score = config['trend_factor'] * math.pow(new_stars * 10, 2) / total_stars / 100
-            popularity_score = total_stars * config['popularity_factor'] / 100
-            update_score = math.exp(-0.05 * (days_since_update + 1) * config['update_factor'] / 100)
-            global_score = (trend_score + popularity_score) * update_score
-            
-            raw_description = custom_node_list.get(url, {}).get('description', "No description available.")
-            corrected_description = markdown_fixer(raw_description)
+    # Load custom node list, descriptions are only looked up for the nodes that made the cut
+    try:
+        nodes_index = open_node_index()
+    except (FileNotFoundError, json.JSONDecodeError, sqlite3.Error) as e:
+        log_('e', f"Error loading custom node list: {e}")
+        return
+    trend_score, popularity_score, update_score, global_score = scores
+    starstracker_data = []
+    try:
+        for i in winners:
+            url = columns['url'][i]
+            row = nodes_index.execute('SELECT description FROM nodes WHERE reference = ?', (url,)).fetchone()
+            raw_description = row[0] if row and row[0] is not None else "No description available."
             starstracker_data.append({
                 "url": url,
                 "title": name_prettifier(url.split('/')[-1]),
-                "description": corrected_description,
-                "new stars": new_stars,
-                "trend score": trend_score,
-                "total stars": total_stars,
-                "popularity score": popularity_score,
-                "updated": days_since_update,
-                "update score": update_score,
-                "global score": global_score
+                "description": markdown_fixer(raw_description),
+                "new stars": int(columns['new stars'][i]),
+                "trend score": float(trend_score[i]),
+                "total stars": int(columns['total stars'][i]),
+                "popularity score": float(popularity_score[i]),
+                "updated": int(columns['updated'][i]),
+                "update score": float(update_score[i]),
+                "global score": float(global_score[i]),
+                "1 day gain": int(columns['1 day gain'][i]),
+                "7 day gain": int(columns['7 day gain'][i]),
+                "30 day gain": int(columns['30 day gain'][i]),
+                "acceleration": int(columns['acceleration'][i]),
+                "rank movement": int(columns['rank movement'][i])
             })
+    finally:
+        nodes_index.close()
 
     # Save starstracker data
     try:
         with open(STARSTRACKER, 'w', encoding='utf-8') as file:
-            json.dump(starstracker_data[:config['top_size']], file, ensure_ascii=False, indent=4)
+            json.dump(starstracker_data, file, ensure_ascii=False, indent=4)
     except IOError as e:
         log_('e', f"Error saving Starstracker data: {e}")
-    # Ensure all items have 'global_score'
-    for item in starstracker_data:
-        if 'global score' not in item:
-            item['global score'] = 0  # Assign a default value if missing
 
-    starstracker_data.sort(key=lambda x: x['global score'], reverse=True)
 
+def open_node_index():
+    # Connection to the custom node index, rebuilt only when custom-node-list.json changed
+    stat = os.stat(CUSTOM_NODE_LIST_PATH)
+    source = f"{stat.st_mtime_ns}:{stat.st_size}"
+    connection = sqlite3.connect(NODE_INDEX)
     try:
-        with open(STARSTRACKER, 'w', encoding='utf-8') as file:
-            json.dump(starstracker_data[:config['top_size']], file, ensure_ascii=False, indent=4)
-    except IOError as e:
-        log_('e', f"Error loading Starstracker data: {e}")
+        connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        connection.execute('CREATE TABLE IF NOT EXISTS nodes (reference TEXT PRIMARY KEY, title TEXT, description TEXT)')
+        row = connection.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+        if row is None or row[0] != source:
+            log_('d', "Rebuilding custom node index")
+            with open(CUSTOM_NODE_LIST_PATH, 'r', encoding='utf-8') as file:
+                custom_nodes = json.load(file).get('custom_nodes', [])
+            with connection:
+                connection.execute('DELETE FROM nodes')
+                connection.executemany(
+                    'INSERT OR REPLACE INTO nodes VALUES (?, ?, ?)',
+                    ((node['reference'], node.get('title'), node.get('description')) for node in custom_nodes if 'reference' in node)
+                )
+                connection.execute("INSERT OR REPLACE INTO meta VALUES ('source', ?)", (source,))
+    except Exception:
+        connection.close()
+        raise
+    return connection
+
+
+def load_columns(current_data, series, installed_nodes):
+    # Turn the GitHub stats and their history into arrays, one entry per repository
+    urls = list(current_data)
+    excluded = set(config['excluded_repos'])
+    total_stars = np.fromiter((details.get("stars", 0) for details in current_data.values()), dtype=np.int64, count=len(urls))
+    history = series_columns(series, urls)
+
+    def gain(days):
+        # Stars gained over the last days, 0 where the repository was not listed yet
+        then = history(days)
+        return np.where(then == MISSING, 0, total_stars - then)
+
+    previous = history(config['days_ago'])
+    eligible = np.fromiter(
+        (url.split('/')[-1] not in installed_nodes and url not in excluded for url in urls),
+        dtype=bool, count=len(urls)
+    ) & (previous != MISSING)
+    last_update = parse_dates([details.get("last_update", "1970-01-01 00:00:00") for details in current_data.values()])
+    days_since_update = (np.datetime64(datetime.now(), 's') - last_update) // np.timedelta64(1, 'D')
+    week_before = history(7)
+    return {
+        'url': urls,
+        'total stars': total_stars,
+        'new stars': total_stars - np.maximum(previous, 0),
+        'updated': days_since_update.astype(np.int64),
+        'eligible': eligible,
+        '1 day gain': gain(1),
+        '7 day gain': gain(7),
+        '30 day gain': gain(30),
+        # This week's gain minus the previous week's
+        'acceleration': gain(7) - np.where((week_before == MISSING) | (history(14) == MISSING), 0, week_before - history(14)),
+        # Positive when the repository climbed in the star ranking over days_ago
+        'rank movement': star_rank(np.maximum(previous, 0)) - star_rank(total_stars)
+    }
+
+
+def star_rank(stars):
+    # Position of every repository when sorted by stars, 0 is the most starred
+    ranks = np.empty(len(stars), dtype=np.int64)
+    ranks[np.argsort(-stars, kind='stable')] = np.arange(len(stars))
+    return ranks
 
-async def display_starstracker(node_index, config):
 
+def parse_dates(date_strings):
     try:
-        with open(STARSTRACKER, 'r', encoding='utf-8') as file:
-            nodes = json.load(file)
-            node = nodes[node_index]
-    except (FileNotFoundError, json.JSONDecodeError, IndexError) as e:
-        log_('e', f"Error loading Starstracker data: {e}")
-        return
+        return np.array(date_strings, dtype='datetime64[s]')
+    except ValueError:
+        # Parse one by one, unreadable dates fall back to the epoch
+        dates = np.empty(len(date_strings), dtype='datetime64[s]')
+        for i, date_string in enumerate(date_strings):
+            try:
+                dates[i] = datetime.strptime(date_string, "%Y-%m-%d %H:%M:%S")
+            except (TypeError, ValueError):
+                dates[i] = np.datetime64(0, 's')
+        return dates
+
+
+def score(columns, config):
+    # Trend, popularity and update decay for every repository at once
+    new_stars = columns['new stars'].astype(np.float64)
+    total_stars = columns['total stars'].astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        trend_score = config['trend_factor'] * np.square(new_stars * 10) / total_stars / 100
+    popularity_score = total_stars * config['popularity_factor'] / 100
+    update_score = np.exp(-0.05 * (columns['updated'] + 1) * config['update_factor'] / 100)
+    global_score = (trend_score + popularity_score) * update_score
+    return trend_score, popularity_score, update_score, global_score
 
+
+def rank(columns, config):
+    # Indices of the top_size best scored candidates, best first, and the scores they were ranked by
+    scores = score(columns, config)
+    global_score = scores[3]
+    candidates = np.flatnonzero(columns['eligible'] & (columns['new stars'] >= config['minimum_new_stars']))
+    top_size = min(config['top_size'], len(candidates))
+    if 0 < top_size < len(candidates):
+        # Partial selection, only the winners get sorted
+        candidates = np.sort(candidates[np.argpartition(-global_score[candidates], top_size - 1)[:top_size]])
+    winners = candidates[np.argsort(-global_score[candidates], kind='stable')][:top_size]
+    return winners, scores
+
+
+def load_series():
+    # Index of the star history and a read-only memory map of its counts
+    try:
+        with open(SERIES_INDEX, 'r', encoding='utf-8') as file:
+            index = json.load(file)
+        stars = np.memmap(SERIES_DATA, dtype=np.int32, mode='r', shape=(len(index['days']), len(index['urls'])))
+    except (FileNotFoundError, json.JSONDecodeError, KeyError, ValueError):
+        return {'days': [], 'commits': [], 'urls': []}, np.empty((0, 0), dtype=np.int32)
+    return index, stars
+
+
+async def update_series():
+    # One github-stats.json version per day over series_days, only new days are read from git
+    index, stars = load_series()
+    # Long enough for days_ago and the 30 day gains
+    since = datetime.now() - timedelta(max(config.get('series_days', 60), config['days_ago'], 30))
+    stats_log = ['log', '--format=%H %cd', '--date=short', '--', os.path.basename(GITHUB_STATS_PATH)]
+    log = await run_git(*stats_log[:3], f"--since={since:%Y-%m-%d %H:%M:%S}", *stats_log[3:], cwd=MANAGER_DIR)
+    if not log:
+        # ComfyUI-Manager has not been updated for a while, start from its last version
+        log = await run_git(stats_log[0], '-1', *stats_log[1:], cwd=MANAGER_DIR)
+    latest = {}
+    for line in log.splitlines():
+        commit, day = line.split()
+        latest.setdefault(day, commit) # The log is newest first, keep each day's last commit
+    days = sorted(latest)
+    if not days or [latest[day] for day in days] == index['commits']:
+        return index, stars
+
+    known = dict(zip(index['days'], range(len(index['days']))))
+    urls = list(index['urls'])
+    columns = {url: i for i, url in enumerate(urls)}
+    rows = []
+    for day in days:
+        position = known.get(day)
+        if position is not None and index['commits'][position] == latest[day]:
+            rows.append(np.array(stars[position]))
+            continue
+        # New day, or the day got more commits since the last update
+        snapshot = await stars_snapshot(latest[day])
+        for url in snapshot:
+            if url not in columns:
+                columns[url] = len(urls)
+                urls.append(url)
+        row = np.full(len(urls), MISSING, dtype=np.int32)
+        row[[columns[url] for url in snapshot]] = list(snapshot.values())
+        rows.append(row)
+    del stars # Release the memory map before the file is replaced
+
+    # Older rows are padded for the URLs that appeared since
+    matrix = np.full((len(days), len(urls)), MISSING, dtype=np.int32)
+    for i, row in enumerate(rows):
+        matrix[i, :len(row)] = row
+    index = {'days': days, 'commits': [latest[day] for day in days], 'urls': urls}
+    os.makedirs(STARS_SERIES_DIR, exist_ok=True)
+    matrix.tofile(SERIES_DATA + '.tmp')
+    with open(SERIES_INDEX + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(index, file, separators=(',', ':'))
+    os.replace(SERIES_DATA + '.tmp', SERIES_DATA)
+    os.replace(SERIES_INDEX + '.tmp', SERIES_INDEX)
+    return load_series()
+
+
+def series_columns(series, urls):
+    # Returns a function giving, for each URL, its star count a number of days ago
+    index, stars = series
+    position = {url: i for i, url in enumerate(index['urls'])}
+    columns = np.fromiter((position.get(url, -1) for url in urls), dtype=np.int64, count=len(urls))
+    known = columns >= 0
+
+    def stars_at(days):
+        # Last recorded day on or before the target, the oldest one if history is shorter
+        target = (date.today() - timedelta(days)).isoformat()
+        row = max(bisect_right(index['days'], target) - 1, 0)
+        return np.where(known, stars[row][np.where(known, columns, 0)], MISSING)
+    return stars_at
+
+
+async def stars_snapshot(commit):
+    # Star counts per repository at a commit, read from git only the first time
+    cache_path = os.path.join(STARS_CACHE_DIR, f'{commit}.json')
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    data = json.loads(await run_git('show', f'{commit}:{os.path.basename(GITHUB_STATS_PATH)}', cwd=MANAGER_DIR))
+    stars = {url: details.get('stars', 0) for url, details in data.items()}
+    try:
+        os.makedirs(STARS_CACHE_DIR, exist_ok=True)
+        with open(cache_path, 'w', encoding='utf-8') as file:
+            json.dump(stars, file, separators=(',', ':'))
+        # Keep only the most recently added snapshots
+        snapshots = sorted(os.scandir(STARS_CACHE_DIR), key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for old in snapshots[STARS_CACHE_SIZE:]:
+            os.remove(old.path)
+    except OSError as e:
+        log_('w', f"Error saving stars cache: {e}")
+    return stars
+
+
+def render_node(node, config):
+    # Rich texts describing one Starstracker.json entry: linked title, scores and description
     title = node.get('title', 'Unknown')
     url = node.get('url', 'Unknown')
     description = node.get('description', 'No description available.')
@@ -139,6 +324,9 @@ async def display_starstracker(node_index, config):
     trend_score = node.get('trend score', 'N/A')
     popularity_score = node.get('popularity score', 'N/A')
     update_score = node.get('update score', 'N/A')
+    gains = [node.get(f'{days} day gain', 0) for days in (1, 7, 30)]
+    acceleration = node.get('acceleration', 0)
+    rank_movement = node.get('rank movement', 0)
 
     score_config = {
         'display_score': 'Score: {:.0f}'.format(global_score),
@@ -147,7 +335,10 @@ async def display_starstracker(node_index, config):
         'display_total_stars': '{} github stars'.format(total_stars),
         'display_popularity_score': 'Popularity score: {:.0f}'.format(popularity_score),
         'display_last_update': 'Updated {} days ago'.format(days_since_update),
-        'display_update_score': 'Update score factor: {:.2f}'.format(update_score)
+        'display_update_score': 'Update score factor: {:.2f}'.format(update_score),
+        'display_gains': '+{} / +{} / +{} stars over 1 / 7 / 30 days'.format(*gains),
+        'display_acceleration': 'Acceleration: {:+d} stars/week'.format(acceleration),
+        'display_rank_movement': 'Rank {:+d}'.format(rank_movement)
     }
 
     scores = [v for k, v in score_config.items() if config.get(k, False)]
@@ -158,19 +349,67 @@ async def display_starstracker(node_index, config):
 
     description_text = Text.assemble(*[(segment, style) for segment, style in parse_markdown(description)])
 
-    console.print(repo_link)
-    console.print(scores_text)
-    console.print(description_text)
-    return
+    return repo_link, Text(scores_text), description_text
     
-async def clone_repo(url, destination):
+async def clone_repo(url, destination, on_progress=None):
+    # Clone url into destination, returns True on success. on_progress receives git's progress lines
     repo_name = url.split('/')[-1]
     repo_path = os.path.join(destination, repo_name)
     if os.path.exists(repo_path) and os.listdir(repo_path):
         log_('e', f"Repository at {repo_path} already exists and is not empty")
-        return
+        return False
+    def show_progress(line):
+        # Redraw git's progress meter on a single line
+        console.print(f"\033[2K\033[G{line}", end='', style='secondary', markup=False, highlight=False)
+
+    # Shallow and blobless clones skip the history and assets that are never used
+    args = ['clone', '--progress']
+    if config.get('clone_depth'):
+        args += ['--depth', str(config['clone_depth'])]
+    if config.get('clone_filter'):
+        args.append(f"--filter={config['clone_filter']}")
+    # Objects of the shared mirror are used in place, only the rest is downloaded
+    # Shallow and blobless clones go without, filling the mirror would download everything they skip
+    mirror = None if config.get('clone_depth') or config.get('clone_filter') else await update_mirror(url)
+    if mirror:
+        args += ['--reference-if-able', mirror]
     try:
-        subprocess.run(['git', 'clone', url, repo_path], check=True)
+        await run_remote_git(url, *args, url, repo_path, on_stderr=on_progress or show_progress)
+        if not on_progress:
+            console.print()
         console.print(f"Successfully cloned {url}", style="up_to_date")
-    except subprocess.CalledProcessError as e:
+        return True
+    except GitCommandError as e:
+        if not on_progress:
+            console.print()
         log_('e', f"Error cloning repository {url}: {e}")
+        return False
+
+
+async def install_repos(urls, destination):
+    # Clone several repositories at once, jobs at a time, with a progress bar each
+    from rich.progress import Progress, BarColumn, TextColumn
+    jobs = asyncio.Semaphore(max(1, int(config.get('jobs', 1))))
+
+    with Progress(
+        TextColumn("{task.description}", style='primary'),
+        BarColumn(bar_width=30, style='secondary', complete_style='primary'),
+        TextColumn("{task.fields[phase]}", style='secondary'),
+        console=console,
+    ) as progress:
+        async def install(url):
+            task = progress.add_task(name_prettifier(url.split('/')[-1]), total=100, phase="queued")
+
+            def on_progress(line):
+                # git reports each phase as "Receiving objects:  45% (..)"
+                match = re.match(r'\s*([A-Za-z ]+):\s+(\d+)%', line)
+                if match:
+                    progress.update(task, completed=int(match.group(2)), phase=match.group(1))
+
+            async with jobs:
+                progress.update(task, phase="starting")
+                installed = await clone_repo(url, destination, on_progress)
+            progress.update(task, completed=100, phase="done" if installed else "failed")
+            return installed
+
+        return await asyncio.gather(*(install(url) for url in urls))
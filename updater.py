@@ -1,20 +1,18 @@
 import os
 import re
-from rich.console import Console
+import time
+import asyncio
+from contextlib import contextmanager
+from datetime import datetime
 from rich.text import Text
-from rich.progress import (
-    Progress, 
-    BarColumn, 
-    TextColumn, 
-    SpinnerColumn, 
-    MofNCompleteColumn,
-    TimeRemainingColumn, 
-    TimeElapsedColumn,
-    ProgressColumn,
-    Task
-)
-from git import Repo, GitCommandError
-from git.exc import NoSuchPathError, InvalidGitRepositoryError
+from gitcmd import run_git, run_remote_git, run_lazy_git, reset_hosts, fetch_options, upstream, GitCommandError
+from report import write_report
+from dashboard import UpdateDashboard
+from dependencies import DEPENDENCY_FILES, install_dependencies
+from lockfile import write_lockfile
+from mirror import use_mirror
+from repo_state import fresh_entry, record_update
+from discovery import discover
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 COMFYUI = os.path.join(THIS_DIR, '../..')
@@ -24,113 +22,265 @@ MANAGER_DIR = os.path.join(CUSTOM_NODES_DIR, 'ComfyUI-Manager')
 CONFIG_PATH = os.path.join(THIS_DIR, 'config.json')
 
 
-from utils import name_prettifier, initialize, log_
+from utils import name_prettifier, initialize, buffered, flush_log, log_enabled, log_
 
 config, theme, console, log_ = initialize(CONFIG_PATH)
 
-secondary = "secondary"
 
-class StyledProgressColumn(ProgressColumn):
-    # Initialize column with the given type and additional arguments
-    def __init__(self, column_type, *args, **kwargs):
-        self.column_instance = column_type(*args, **kwargs)
+async def git(dir_path):
+    # Update one repository and describe the outcome: flag (UTD, outdated or error), infos, url and the path taken
+    # The timings of each phase and the bytes fetched go to the run report
+    # before and after are the commits around the update, dependencies the requirement files that changed between them
+    status = {'flag': "error", 'infos': "", 'url': dir_path, 'path': None, 'timings': {}, 'bytes_fetched': 0, 'before': None, 'after': None, 'dependencies': []} # The path stands in for the URL until it is known
+    try:
+        with timed(status, 'discovery'):
+            status['url'] = await run_git('remote', 'get-url', 'origin', cwd=dir_path) # Get the repository URL
+            log_('d', "\nProcessing %s", dir_path)
+            # Capture the SHA of the commit before pulling
+            before_pull_sha = status['before'] = await run_git('rev-parse', 'HEAD', cwd=dir_path)
+            # Like a plain pull, follow the upstream of the checked out branch
+            try:
+                tracked = await upstream(dir_path)
+            except GitCommandError:
+                status.update(infos="The checked out branch has no upstream branch to update from.")
+                return status
+            if tracked is None:
+                # ComfyUI-Manager pins versions with a detached HEAD, the pin is left where it is
+                log_('d', "%s has a detached HEAD, left at its pinned commit", dir_path)
+                status.update(flag="UTD", path="detached")
+                return status
+            remote, remote_branch, tracking_ref = tracked
+            if remote != 'origin':
+                status['url'] = await run_git('remote', 'get-url', remote, cwd=dir_path)
+        # A recent prefetch already brought the remote tip into the tracking ref, no network is needed
+        prefetched = fresh_entry(dir_path) is not None
+        # Compare with the remote tip first, the working tree is only touched if it moved
+        with timed(status, 'precheck'):
+            moved = not config.get('precheck', True) or await remote_moved(dir_path, status['url'], tracked, before_pull_sha, prefetched)
+        if not moved:
+            log_('d', "%s matches %s/%s, pull skipped", dir_path, remote, remote_branch)
+            status.update(flag="UTD", path="precheck")
+            return status
+
+        # Objects already in the shared mirror are borrowed instead of fetched again
+        if not prefetched:
+            with timed(status, 'mirror'):
+                await use_mirror(dir_path, status['url'])
+        # Keep the ref updates reported on stderr
+        fetch_result = []
+        objects_before = await object_bytes(dir_path)
+        if config.get('update_strategy', 'fast-forward') == 'fast-forward' and await fast_forward(dir_path, status['url'], tracked, fetch_result, status, prefetched):
+            status['path'] = "prefetched" if prefetched else "fast-forward"
+        else:
+            await stash_pull(dir_path, status['url'], fetch_result, status, tracking_ref if prefetched else None)
+            status['path'] = "stash"
+        status['bytes_fetched'] = max(await object_bytes(dir_path) - objects_before, 0)
+        # Capture the SHA of the commit after the pull
+        after_pull_sha = status['after'] = await run_git('rev-parse', 'HEAD', cwd=dir_path)
+        if before_pull_sha == after_pull_sha:
+            status['flag'] = "UTD"
+            return status
+        # Requirement files touched by the new commits, installed once all repositories are updated
+        status['dependencies'] = (await run_git(
+            'diff', '--name-only', f'{before_pull_sha}..{after_pull_sha}', '--', *DEPENDENCY_FILES, cwd=dir_path
+        )).splitlines()
+
+        infos = ""
+        if config.get('display_fetch'):
+            fetches = [line.strip() for line in fetch_result if '->' in line]
+            infos += "\n".join(fetches)
+        # Changelog and README changes are only worth reading if the outdated message gets logged
+        if log_enabled('w'):
+            commit_logs, readme_modifs = await get_changes(dir_path, before_pull_sha, after_pull_sha, status)
+            infos += commit_logs
+            if readme_modifs:
+                infos += f"\n\nReadme.md update :\n{readme_modifs}"
+
+        status.update(flag="outdated", infos=infos)
+        return status
     
-    # Render method to apply custom style for progress columns
-    def render(self, task: Task) -> Text:
-        text = self.column_instance.render(task)
-        text.style = secondary
-        return text
+    except (GitCommandError, ValueError, PermissionError, OSError, Exception) as e:
+        error_type = e.__class__.__name__
+        status.update(flag="error", infos=f"{error_type}: {e}")
+        # HEAD may have moved before the failure, a stash pop conflicting after the pull, the lockfile records where it is
+        if status['before']:
+            try:
+                status['after'] = await run_git('rev-parse', 'HEAD', cwd=dir_path)
+            except GitCommandError:
+                pass
+        return status
+
+
+@contextmanager
+def timed(status, phase):
+    # Add the time spent in the block to the phase timings of a repository status
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        status['timings'][phase] = status['timings'].get(phase, 0) + time.perf_counter() - start
+
 
-    # Fallback for other attributes
-    def __getattr__(self, name):
-        return getattr(self.column_instance, name)
+async def object_bytes(dir_path):
+    # Size of the object database, loose objects and packs, as reported by git
+    counts = dict(
+        line.split(': ', 1) for line in (await run_git('count-objects', '-v', cwd=dir_path)).splitlines() if ': ' in line
+    )
+    return (int(counts.get('size', 0)) + int(counts.get('size-pack', 0))) * 1024
 
 
-def git(dir_path):
+async def fast_forward(dir_path, url, tracked, fetch_result, status, prefetched=False):
+    # Fetch the upstream branch and fast-forward onto it, leaving the index and local changes alone
+    # Prefetched repositories fast-forward onto their tracking ref without fetching
+    remote, remote_branch, tracking_ref = tracked
+    target = tracking_ref if prefetched else 'FETCH_HEAD'
+    if not prefetched:
+        with timed(status, 'fetch'):
+            await run_remote_git(url, 'fetch', '-v', *await fetch_options(dir_path), remote, remote_branch, cwd=dir_path, on_stderr=fetch_result.append)
     try:
-        repo = Repo(dir_path) # Initialize the repository from local directory
-        origin = repo.remotes.origin # Get the origin remote
-        repo_url = repo.remotes.origin.url # Get the repository URL
-        log_('d', f"\nProcessing {dir_path}")
-        # Find the default branch
-        try:
-            default_branch = repo.git.symbolic_ref('refs/remotes/origin/HEAD').split('/')[-1]
-        except (GitCommandError, ValueError) as e:
-            error_message = f"error during default branch detection: {e}"
-            return "error", error_message, dir_path
+        with timed(status, 'pull'):
+            await run_lazy_git('merge', '--ff-only', target, cwd=dir_path)
+        return True
+    except GitCommandError as e:
+        # Diverged history or local changes in the way
+        log_('d', "%s cannot be fast-forwarded, falling back to stash: %s", dir_path, e)
+        return False
 
-        if not default_branch:
-            error_message = "Impossible to determine the default branch."
-            return "error", error_message, dir_path
 
-        # Capture the SHA of the commit before pulling
-        before_pull_sha = repo.head.commit.hexsha
+async def stash_pull(dir_path, url, fetch_result, status, prefetched_ref=None):
+    with timed(status, 'stash'):
         # Reset to a clean state
-        repo.git.reset('--mixed')
+        await run_git('reset', '--mixed', cwd=dir_path)
         # Stash local modifications if necessary
-        stash_result = repo.git.stash('push', '-m', 'auto-stash-before-pull')
-        # Perform the pull
-        fetch_result = origin.pull(allow_unrelated_histories=True)
-        # Pop stashed changes if necessary
-        if stash_result != 'No local changes to save':
-            repo.git.stash('pop')
-        # Capture the SHA of the commit after the pull
-        after_pull_sha = repo.head.commit.hexsha
-        infos = ""
-        new_commits = []
-        # Get the logs of commits between the two SHAs
-        if before_pull_sha != after_pull_sha:
-            # Extract new commits introduced by the pull
-            new_commits = list(repo.iter_commits(f'{before_pull_sha}..{after_pull_sha}'))
+        stash_result = await run_git('stash', 'push', '-m', 'auto-stash-before-pull', cwd=dir_path)
+    # Perform the pull, a prefetched branch is merged from its tracking ref without going to the network
+    with timed(status, 'pull'):
+        if prefetched_ref:
+            await run_lazy_git('merge', '--allow-unrelated-histories', prefetched_ref, cwd=dir_path)
+        else:
+            # A plain pull follows the upstream of the checked out branch
+            # pull takes no --filter, a repository already converted keeps its filter in its config
+            await run_remote_git(url, 'pull', '-v', '--allow-unrelated-histories', *await fetch_options(dir_path, filters=False), cwd=dir_path, on_stderr=fetch_result.append)
+    # Pop stashed changes if necessary
+    if stash_result != 'No local changes to save':
+        with timed(status, 'stash'):
+            await run_git('stash', 'pop', cwd=dir_path)
 
-        if config.get('display_fetch'):
-            fetches = [f"{fetch.ref.name} {fetch.note}" for fetch in fetch_result]
-            infos += "\n".join(fetches)
-        # If the display_logs config is enabled, add commit logs to infos
-        if config.get('display_logs'):
-            infos += get_commit_logs(new_commits)
-        # Check if there is a README.md file and add its diff to infos if it was modified
-        if config.get('display_readme'):
-            readme_path = os.path.join(dir_path, 'README.md') # Path to the README.md file
-            if os.path.exists(readme_path):
-                diff = repo.git.diff(f'{before_pull_sha}..{after_pull_sha}', '-p', readme_path) #
-                log_('d', f"Diff for README.md: {diff}")
-                if diff:
-                    infos += f"\n\nReadme.md update :\n{get_readme_modifs(diff)}"
-                    log_('d', "readme.md update added to infos")
-
-        return ("outdated", infos, repo_url) if before_pull_sha != after_pull_sha else ("UTD", "", repo_url)
-    
-    except (NoSuchPathError, InvalidGitRepositoryError, GitCommandError, ValueError, PermissionError, OSError, Exception) as e:
-        error_type = e.__class__.__name__
-        error_message = f"{error_type}: {e}"
-        return "error", error_message, repo_url
+
+async def remote_moved(dir_path, url, tracked, local_sha, prefetched=False):
+    # A single ls-remote tells whether the upstream branch differs from the local commit
+    # After a recent prefetch the tracking ref is the remote tip as far as this run is concerned
+    remote, remote_branch, tracking_ref = tracked
+    if prefetched:
+        try:
+            remote_sha = await run_git('rev-parse', '--verify', '-q', tracking_ref, cwd=dir_path)
+        except GitCommandError:
+            return True
+    else:
+        remote_sha = (await run_remote_git(url, 'ls-remote', remote, f'refs/heads/{remote_branch}', cwd=dir_path)).split('\t')[0]
+    if not remote_sha:
+        return True # Let the full pull path report what is wrong
+    if remote_sha == local_sha:
+        return False
+    # Local commits on top of an already fetched remote tip are up to date as well
+    try:
+        tracking_sha = await run_git('rev-parse', '--verify', '-q', tracking_ref, cwd=dir_path)
+        if tracking_sha != remote_sha:
+            return True
+        await run_git('merge-base', '--is-ancestor', remote_sha, local_sha, cwd=dir_path)
+        return False
+    except GitCommandError:
+        return True
+
+
+async def is_ancestor(dir_path, ancestor, descendant):
+    # False as well when a shallow history hides how the two commits are related
+    try:
+        await run_git('merge-base', '--is-ancestor', ancestor, descendant, cwd=dir_path)
+        return True
+    except GitCommandError:
+        return False
+
+
+async def get_changes(dir_path, before_sha, after_sha, status):
+    # Commit summaries and README additions between two commits, read concurrently, each in a single git call
+    async def commit_logs():
+        if not config.get('display_logs'):
+            return ""
+        with timed(status, 'log'):
+            logs = get_commit_logs(await get_commits(dir_path, before_sha, after_sha))
+            # A shallow fetch cuts the history between the two commits, only the fetched ones can be listed
+            if not await is_ancestor(dir_path, before_sha, after_sha):
+                logs += "\n(history truncated by a shallow fetch, older new commits are not listed)\n"
+            return logs
+
+    async def readme_modifs():
+        if not config.get('display_readme') or not os.path.exists(os.path.join(dir_path, 'README.md')):
+            return ""
+        # Only the added lines are kept while the diff streams in
+        added_lines = []
+        def collect(line):
+            if line.startswith('+') and not line.startswith('+++'):
+                added_lines.append(line[1:])
+        with timed(status, 'readme'):
+            try:
+                await run_lazy_git('diff', '-U0', f'{before_sha}..{after_sha}', '--', 'README.md', cwd=dir_path, on_stdout=collect)
+            except GitCommandError as e:
+                # Partial clones fetch the README blobs on demand, which may fail offline
+                log_('d', "README.md changes of %s unavailable: %s", dir_path, e)
+                return "(unavailable, the README of a partial clone could not be fetched)"
+            log_('d', "%d lines added to README.md", len(added_lines))
+            return get_readme_modifs(added_lines)
+
+    return await asyncio.gather(commit_logs(), readme_modifs())
+
+
+# Commit fields shown in the changelog: config switch, key and git log placeholder
+COMMIT_FIELDS = [
+    ('display_commit', 'hexsha', '%H'),
+    ('display_date', 'authored_datetime', '%aI'),
+    ('display_author', 'author', '%an'),
+    ('display_email', 'email', '%ae'),
+]
+
+
+async def get_commits(dir_path, before_sha, after_sha):
+    # Read the new commits in one git log call, fields separated by \x1f and commits by \x1e
+    fields = [(key, placeholder) for switch, key, placeholder in COMMIT_FIELDS if config.get(switch)]
+    log_format = '%x1f'.join([placeholder for key, placeholder in fields] + ['%B']) + '%x1e'
+    output = await run_git('log', f'--format={log_format}', f'{before_sha}..{after_sha}', cwd=dir_path)
+    commits = []
+    for record in output.split('\x1e'):
+        if not record.strip():
+            continue
+        *values, message = record.strip('\n').split('\x1f')
+        commit = dict(zip((key for key, placeholder in fields), values), message=message)
+        if 'authored_datetime' in commit:
+            commit['authored_datetime'] = datetime.fromisoformat(commit['authored_datetime'])
+        commits.append(commit)
+    return commits
 
 
 def get_commit_logs(commits):
     logs = []
     for commit in commits:
             log_entry = []
-            display_config = config.get
-            if display_config('display_commit'):
-                    log_entry.append(f"{commit.hexsha[:7]}:")
-            if display_config('display_date'):
-                    log_entry.append(f"{commit.authored_datetime}:")
-            if display_config('display_author'):
-                    log_entry.append(f"{commit.author.name}")
-            if display_config('display_email'):
-                    log_entry.append(f"<{commit.author.email}>")
-            clean_message = " ".join(line.strip() for line in commit.message.splitlines() if line.strip())
+            if 'hexsha' in commit:
+                    log_entry.append(f"{commit['hexsha'][:7]}:")
+            if 'authored_datetime' in commit:
+                    log_entry.append(f"{commit['authored_datetime']}:")
+            if 'author' in commit:
+                    log_entry.append(f"{commit['author']}")
+            if 'email' in commit:
+                    log_entry.append(f"<{commit['email']}>")
+            clean_message = " ".join(line.strip() for line in commit['message'].splitlines() if line.strip())
             log_entry.append(clean_message)
             logs.append("\n  ".join(log_entry).strip())
             logs.append("")
     return "\n".join(logs)
 
 
-def get_readme_modifs(diff):
-    # Use a regular expression to extract the modified lines
-    modified_lines = re.findall(r'^\+(.*)$', diff, re.MULTILINE)
-    
+def get_readme_modifs(modified_lines):
     # Group the lines into paragraphs and retrieve the section titles
     paragraphs, current_paragraph = [], []
     current_title = None
@@ -138,84 +288,91 @@ def get_readme_modifs(diff):
     # Iterate through each modified line
     for line in modified_lines:
         line = line.strip()
-        if re.match(r'^#+ ', line):
+        if line.startswith('#') and re.match(r'^#+ ', line):
             # If there's a current paragraph, append it as a tuple (title, paragraph)
             if current_paragraph:
                 paragraphs.append((current_title, '\n'.join(current_paragraph)))
-                log_('d', "paragraph is added")
                 current_paragraph = []
             current_title = line
         elif line:
             current_paragraph.append(line)
-            log_('d', "line is added to current_paragraph")
         else:
             if current_paragraph:
                 paragraphs.append((current_title, '\n'.join(current_paragraph)))
                 current_paragraph, current_title = [], None
-                log_('d', "paragraph is reset and added to paragraphs")
     # After loop, if any paragraph remains, append it to paragraphs
     if current_paragraph:
         paragraphs.append((current_title, '\n'.join(current_paragraph)))
-        log_('d', "last paragraph is added to paragraphs")
     
     # Format the output to include the section titles
     readme_modifs = [f"{title}\n{paragraph}" if title else paragraph for title, paragraph in paragraphs]
-    log_('d', 'readme_modifs is created')
-
     return '\n\n'.join(readme_modifs)
 
 
 async def update():
+    started, start = datetime.now(), time.perf_counter()
+    reset_hosts()
     log_('i', 'Updating ComfyUI repository')
-    fetch_flag, infos, url = git(COMFYUI)
-    display(fetch_flag, 'ComfyUI', infos, url)
+    status = await git(COMFYUI)
+    display(status, 'ComfyUI')
+    paths = {status['path']: 1}
+    results = [('ComfyUI', COMFYUI, status)]
 
     log_('i', 'Updating custom_nodes repositories')
-    dirs = [dir for dir in os.scandir(CUSTOM_NODES_DIR) if dir.is_dir() and dir.name != "__pycache__"]
-
-    def update_repo(task, dir):
-            # Get the local path of the repository
-            dir_path = dir.path
-            # Prettify the repository name for display purposes
-            repo_pretty = name_prettifier(dir.name)
-            # Retrieve state, informations, and URLof installed custom nodes
-            fetch_flag, infos, url = git(dir_path)
-
-            progress.update(task)
-            display(fetch_flag, repo_pretty, infos, url)
-            progress.update(task, advance=1)
-
-    with Progress(
-        StyledProgressColumn(TextColumn, text_format="{task.description}"),
-        StyledProgressColumn(TextColumn, text_format="{task.percentage:>3.0f}%"),
-        StyledProgressColumn(BarColumn, bar_width=30, style='primary', complete_style='primary'),
-        SpinnerColumn(style='primary'),  
-        StyledProgressColumn(MofNCompleteColumn),
-        TextColumn("-", style='primary'), 
-        StyledProgressColumn(TimeRemainingColumn),
-        TextColumn("-", style='primary'), 
-        StyledProgressColumn(TimeElapsedColumn),
-        console=console,
-        transient=False,
-    ) as progress:
-        task = progress.add_task("Updating repositories...", total=len(dirs))
-        for dir in dirs:
-            update_repo(task, dir)
-
-
-def display(fetch_flag, repo_name, infos, url):
+    discovery_start = time.perf_counter()
+    # Disabled nodes, plain folders and repositories without a remote never reach git()
+    dirs, skipped = discover(CUSTOM_NODES_DIR)
+    discovery = time.perf_counter() - discovery_start
+    if skipped:
+        log_('i', "Not updated: " + ", ".join(f"{len(names)} {kind}" for kind, names in skipped.items()))
+        log_('d', "\n".join(f"{kind}: {', '.join(names)}" for kind, names in skipped.items()))
+    # Number of repositories fetched and pulled at the same time
+    jobs = asyncio.Semaphore(max(1, int(config.get('jobs', 1))))
+
+    async def update_repo(dir):
+        async with jobs:
+            dashboard.started(name_prettifier(dir.name))
+            status, output = await buffered(git, dir.path)
+            dashboard.finished(name_prettifier(dir.name), status)
+            return status, output
+
+    with UpdateDashboard(console, config, len(dirs)) as dashboard:
+        # Start every update right away, the semaphore bounds how many run at once
+        pending = [asyncio.create_task(update_repo(dir)) for dir in dirs]
+        try:
+            # Results go to the scrollback in directory order, whatever order they finish in
+            for dir, repo_task in zip(dirs, pending):
+                status, output = await repo_task
+                flush_log(output, console)
+                display(status, name_prettifier(dir.name))
+                paths[status['path']] = paths.get(status['path'], 0) + 1
+                results.append((dir.name, dir.path, status))
+        finally:
+            # Cancelling update() stops the git processes still running
+            for repo_task in pending:
+                repo_task.cancel()
+
+    # Report how much work the cheaper update paths avoided
+    path_names = {'precheck': "skipped by pre-check", 'detached': "left on their pinned commit", 'prefetched': "applied from prefetch", 'fast-forward': "fast-forwarded", 'stash': "stashed and pulled"}
+    log_('i', ", ".join(f"{paths[path]} {name}" for path, name in path_names.items() if path in paths))
+    await install_dependencies(results)
+    write_report(results, started, time.perf_counter() - start, discovery)
+    write_lockfile(results, started)
+    record_update(results)
+
+
+def display(status, repo_name):
+    fetch_flag, infos, url, path = status['flag'], status['infos'], status['url'], status['path']
     # Nodes names with rich custom style and hyperlinks to their repositories
     repo_link = Text(repo_name, style=f"link {url} {config['theme']['repo']}")
-    
-    # Clear the previous line for each loop iteration if 'compact' in config is true. Overwrite up-to-date nodes.
-    if config.get('compact'):
-        console.print('\033[F\033[K', end='')
-        
+
     if fetch_flag == "UTD":
-        console.print('🗸', repo_link, style="up_to_date")
-        log_('i', f"{repo_name} is up to date")
+        # In compact mode up-to-date nodes are only counted on the dashboard
+        if not config.get('compact'):
+            console.print('🗸', repo_link, style="up_to_date")
+        log_('i', "%s is up to date (%s)", repo_name, path)
     elif fetch_flag == "outdated":
-        log_('w', f"🡅 {repo_link} \n {infos} \n")
+        log_('w', f"🡅 {repo_link} ({path}) \n {infos} \n")
     elif fetch_flag == "error":
         log_('e', f"🞫 {repo_link} \n {infos} \n")
     else:
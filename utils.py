@@ -5,23 +5,48 @@ import sys
 import logging
 import datetime
 import subprocess
-import pkg_resources
-from rich.console import Console
-from rich.theme import Theme
-from prompt_toolkit.application import Application
-from prompt_toolkit.key_binding import KeyBindings
-from prompt_toolkit.keys import Keys
-from prompt_toolkit.layout.controls import FormattedTextControl
-from prompt_toolkit.styles import Style
-from prompt_toolkit.layout import Layout
-from prompt_toolkit.layout.containers import HSplit, Window
-from rich.theme import Theme
+import contextvars
+import atexit
+import queue
+from logging.handlers import QueueHandler, QueueListener
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 CONFIG_PATH = os.path.join(THIS_DIR, 'config.json')
+REQUIREMENTS_CACHE = os.path.join(THIS_DIR, 'requirements_cache.json')
+# Where log files are written and pruned
+LOG_DIR = THIS_DIR
 
+# When set, console output of log_ is held back in this list instead of being printed
+_log_buffer = contextvars.ContextVar('log_buffer', default=None)
+# Log records waiting for the listener thread, which owns the log file
+_log_queue = queue.SimpleQueue()
+_log_listener = None
+# Runtime contexts already built in this process, keyed by config path
+_contexts = {}
+# Short level names accepted by log_
+LOG_LEVELS = {
+    'n': 'NOTSET',
+    'i': 'INFO',
+    'd': 'DEBUG',
+    'w': 'WARNING',
+    'e': 'ERROR',
+    'c': 'CRITICAL'
+}
+
+
+def initialize(config_path=CONFIG_PATH):
+    # Every module shares one runtime context, built on first use
+    key = os.path.abspath(config_path)
+    if key not in _contexts:
+        _contexts[key] = _create_context(config_path)
+    return _contexts[key]
+
+
+def _create_context(config_path):
+    # Rich is imported here so that importing utils stays cheap
+    from rich.console import Console
+    from rich.theme import Theme
 
-def initialize(config_path):
     # Load configuration from the provided path
     if not os.path.exists(config_path):
         sys.stderr.write(f"ERROR: Configuration file not found at {config_path}\n")
@@ -45,84 +70,193 @@ def initialize(config_path):
         numeric_level = logging.WARNING
     # Initialize Rich console with custom theme
     console = Console(theme=custom_theme, highlight=False, log_time=False)
-    # Set up file logger
+    # Set up file logger, records are written to disk by a listener thread
     logger = logging.getLogger('fileLogger')
     logger.setLevel(numeric_level)
-
-    log_filename = f"log-{datetime.datetime.now().strftime('%Y-%m-%d_%Hh%Mm%Ss')}.log"
-    log_path = os.path.join(THIS_DIR, log_filename)
-    handler = logging.FileHandler(log_path, encoding='utf-8')
-    handler.setLevel(numeric_level)
-    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
     logger.handlers.clear()  # Clear existing handlers to avoid duplicates
-    logger.addHandler(handler)
+    logger.addHandler(_file_log_handler(numeric_level))
     logger.propagate = False  # Prevent log messages from being propagated to the root logger
-    
-    # Clean up old log files, keeping only the 3 most recent
+    # Numeric level and console style of each short level name, resolved once
+    levels = {short: (getattr(logging, name), name.lower()) for short, name in LOG_LEVELS.items()}
+    threshold = logger.getEffectiveLevel()
+
+    # Function to log messages both to the file and console
+    def log_(level, msg, *args):
+        numeric_level, style = levels.get(level.lower(), levels['w']) # Default to WARNING if invalid level is provided
+        if numeric_level < threshold:
+            return # Disabled level, msg is never formatted
+        if args:
+            msg = msg % args
+        logger.log(numeric_level, msg)
+        buffer = _log_buffer.get()
+        if buffer is not None:
+            # Keep the message for later, a concurrent job is running
+            buffer.append((msg, style))
+        else:
+            # Log to console using Rich with appropriate style, messages are plain text
+            console.log(msg, style=style, markup=False)
+
+    return config, custom_theme, console, log_
+
+
+def _file_log_handler(numeric_level):
+    # The first call of the process starts the listener thread and prunes old log files
+    global _log_listener
+    if _log_listener is None:
+        log_filename = f"log-{datetime.datetime.now().strftime('%Y-%m-%d_%Hh%Mm%Ss')}.log"
+        # The file is only created once something is logged
+        handler = logging.FileHandler(os.path.join(LOG_DIR, log_filename), encoding='utf-8', delay=True)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        _log_listener = QueueListener(_log_queue, handler, respect_handler_level=True)
+        _log_listener.start()
+        atexit.register(_log_listener.stop) # Drain the queue before the interpreter exits
+        _prune_logs()
+    _log_listener.handlers[0].setLevel(numeric_level)
+    return QueueHandler(_log_queue)
+
+
+def _prune_logs():
+    # Clean up old log files, keeping only the 3 most recent with the one of this process
     log_files = sorted(
-        [f for f in os.listdir(THIS_DIR) if f.startswith('log-')],
-        key=lambda x: os.path.getmtime(os.path.join(THIS_DIR, x)),
+        [f for f in os.listdir(LOG_DIR) if f.startswith('log-')],
+        key=lambda x: os.path.getmtime(os.path.join(LOG_DIR, x)),
         reverse=True
     )
-    for old_file in log_files[3:]: # Keep only the 3 most recent logs
+    for old_file in log_files[2:]: # The file of this process is not created yet
         try:
-            os.remove(os.path.join(THIS_DIR, old_file))
+            os.remove(os.path.join(LOG_DIR, old_file))
         except OSError as e:
-            log_('e', f"error when deleting {old_file}: {e}")
+            sys.stderr.write(f"error when deleting {old_file}: {e}\n")
 
-    # Function to log messages both to the file and console
 
-    def log_(level, msg):
-        log_levels = {
-            'n': 'NOTSET',
-            'i': 'INFO',
-            'd': 'DEBUG',
-            'w': 'WARNING',
-            'e': 'ERROR',
-            'c': 'CRITICAL'
-        }
-        
-        level = log_levels.get(level.lower(), 'WARNING') # Default to WARNING if invalid level is provided
-        numeric_level = getattr(logging, level, logging.WARNING)
-        if not isinstance(numeric_level, int):
-            numeric_level = logging.WARNING
+def log_(level, msg, *args):
+    # Log through the shared runtime context, msg % args is only computed if the level is enabled
+    initialize()[3](level, msg, *args)
 
-        logger.log(numeric_level, msg)
-        if logger.isEnabledFor(numeric_level):
-            # Log to console using Rich with appropriate style
-            console.log(f"[{level.lower()}]{msg}[/]", style=level.lower())
-    return config, custom_theme, console, log_
 
-config, theme, console, log_ = initialize(CONFIG_PATH)
+def log_enabled(level):
+    # Whether log_ would output a message of this level
+    initialize()
+    return logging.getLogger('fileLogger').isEnabledFor(getattr(logging, LOG_LEVELS.get(level.lower(), 'WARNING')))
 
 
+async def buffered(func, *args):
+    # Await func while collecting its console output, so parallel jobs never interleave
+    buffer = []
+    token = _log_buffer.set(buffer)
+    try:
+        return await func(*args), buffer
+    finally:
+        _log_buffer.reset(token)
+
+
+def flush_log(buffer, console=None):
+    # Print console output collected by buffered()
+    console = console or initialize()[2]
+    for msg, style in buffer:
+        console.log(msg, style=style, markup=False)
+
+
+
+def environment_fingerprint(*requirements_paths):
+    # Changes whenever one of the requirements files, the interpreter or its site-packages change
+    import sysconfig
+    paths = [*requirements_paths] + sorted({sysconfig.get_paths()[key] for key in ('purelib', 'platlib')})
+    stats = [f"{os.stat(path).st_mtime_ns}:{os.stat(path).st_size}" for path in paths if os.path.exists(path)]
+    return "|".join([sys.executable, sys.version, *stats])
+
+
+def strip_comment(line):
+    # pip only reads # as a comment at the start of a line or after whitespace, URL fragments like #egg= stay
+    return re.split(r'(?:^|\s)#', line, maxsplit=1)[0].strip()
+
+
+def missing_requirements(requirements):
+    # Return the requirement lines that the installed distributions do not satisfy
+    # Nested files and editable installs cannot be checked here and are always returned, other pip options are left to pip
+    from importlib import metadata
+    try:
+        from packaging.requirements import Requirement, InvalidRequirement
+    except ImportError:
+        Requirement = None # Without packaging only the distribution names are checked
+    missing = []
+    for line in requirements:
+        line = strip_comment(line)
+        if not line:
+            continue  # Skip empty lines and comments
+        if line.startswith('-'):
+            if re.match(r'-[re]|--requirement|--editable', line):
+                missing.append(line)
+            continue
+        if Requirement is None:
+            name, specifier, marker = re.match(r'[A-Za-z0-9._-]*', line).group(), None, None
+        else:
+            try:
+                requirement = Requirement(line)
+            except InvalidRequirement:
+                missing.append(line)
+                continue
+            name, specifier, marker = requirement.name, requirement.specifier, requirement.marker
+        if marker is not None and not marker.evaluate():
+            continue  # Not meant for this platform or interpreter
+        try:
+            version = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            missing.append(line)
+            continue
+        if specifier is not None and not specifier.contains(version, prereleases=True):
+            missing.append(line)
+    return missing
+
 
 def requirements_installer(requirements_path):
     # Check if the requirements file exists
     if not os.path.exists(requirements_path):
         log_('w', f"Requirements file not found at {requirements_path}")
         return
+    # Nothing changed since the last successful check
+    fingerprint = environment_fingerprint(requirements_path)
+    try:
+        with open(REQUIREMENTS_CACHE, 'r', encoding='utf-8') as file:
+            if json.load(file).get(requirements_path) == fingerprint:
+                log_('d', "Requirements unchanged since the last check")
+                return
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
     # Read requirements from the file
-    with open(requirements_path, 'r') as file:
+    with open(requirements_path, 'r', encoding='utf-8') as file:
         requirements = file.read().splitlines()
-    for package in requirements:
-        if not package:
-            continue  # Skip empty lines
+    missing = missing_requirements(requirements)
+    if missing:
+        log_('d', f"{', '.join(missing)} not installed. Installing...")
+        try:
+            # A single pip resolution of the whole file, which keeps its index options, nested files and hashes
+            subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", requirements_path])
+            log_('i', f"{', '.join(missing)} installed")
+        except subprocess.CalledProcessError as e:
+            log_('e', f"Failed to install {', '.join(missing)}: {e}")
+            return
+    else:
+        log_('i', "Requirements are already installed")
+    # Remember the state that satisfied the requirements, pip may have changed it
+    try:
+        with open(REQUIREMENTS_CACHE, 'w', encoding='utf-8') as file:
+            json.dump({requirements_path: environment_fingerprint(requirements_path)}, file, indent=4)
+    except OSError as e:
+        log_('w', f"Error saving requirements cache: {e}")
 
-        # Check if the package is already installed
-        if package in pkg_resources.working_set.by_key:
-            log_('i', f"{package} is already installed")
-        else:
-            log_('d', f"{package} is not installed. Installing...")
-            try:
-                # Attempt to install the package using pip
-                subprocess.check_call([sys.executable, "-m", "pip", "install", package])
-                log_('i', f"{package} has been installed")
-            except subprocess.CalledProcessError as e:
-                log_('e', f"Failed to install {package}: {e}")
 
+async def menu(menu_items, config, extra_keys=None):
+    # Returns the index of the chosen item, the value of a pressed extra key, or None on Escape
+    # prompt_toolkit is only loaded once a menu is actually shown
+    from prompt_toolkit.application import Application
+    from prompt_toolkit.key_binding import KeyBindings
+    from prompt_toolkit.keys import Keys
+    from prompt_toolkit.layout.controls import FormattedTextControl
+    from prompt_toolkit.styles import Style
+    from prompt_toolkit.layout import Layout
+    from prompt_toolkit.layout.containers import HSplit, Window
 
-async def menu(menu_items, config):
     primary_color = config['theme'].get('primary', 'white')  # Default to the 'default' color if not specified
     style = Style.from_dict({
         'selected_item': f'reverse bold {primary_color}',  # Style for selected menu item
@@ -164,11 +298,25 @@ async def menu(menu_items, config):
     def cancel(event):
         app.result = None
         event.app.exit()
+    for key, value in (extra_keys or {}).items():
+        @bindings.add(key)
+        def extra(event, value=value):
+            app.result = value
+            event.app.exit()
 
     await app.run_async()
     return app.result
 
 
+async def ask(message):
+    # Read one line of text from the user, None if cancelled
+    from prompt_toolkit import PromptSession
+    try:
+        return await PromptSession().prompt_async(message)
+    except (KeyboardInterrupt, EOFError):
+        return None
+
+
 def name_prettifier(directory):
     # Format directory names
     title = re.sub(r'(?i)^comfy(?:ui[_\- ]?|[_\- ])', '', directory)